@@ -0,0 +1,236 @@
+"""Headless benchmarks for pyslobs, run against the in-process MockSlobsServer so no
+Streamlabs instance is needed. Results are printed (or written with --output) as JSON
+so runs from different versions can be compared, e.g.
+
+    python benchmark.py --output before.json
+    python benchmark.py --quick
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pyslobs
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "min": samples[0],
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": samples[-1],
+    }
+
+
+class ChunkTransport(pyslobs.Transport):
+    """Hands out pre-encoded chunks as if they came off the pipe, to time the receive path on its own"""
+
+    def __init__(self, chunks: list):
+        self.chunks = iter(chunks)
+
+    async def open(self) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return next(self.chunks, b"")
+
+    def write(self, data: bytes) -> None:
+        pass
+
+
+async def bench_round_trip(slobs: pyslobs.Slobs, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await slobs.connection.send_and_wait_response("activeScene", "ScenesService")
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_throughput(slobs: pyslobs.Slobs, callers: int, requests_per_caller: int) -> dict:
+    samples = []
+
+    async def caller():
+        for _ in range(requests_per_caller):
+            start = time.perf_counter()
+            await slobs.connection.send_and_wait_response("activeScene", "ScenesService")
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(callers)))
+    elapsed = time.perf_counter() - start
+    return {"callers": callers, "requests": len(samples), "elapsed": elapsed,
+            "requests_per_sec": len(samples) / elapsed, "latency": summarize(samples)}
+
+
+async def bench_promises(slobs: pyslobs.Slobs, iterations: int) -> dict:
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        promise = await slobs.connection.send_and_wait_promise("create", "SceneCollectionsService", [{"name": f"bench {i}"}])
+        await promise.get()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_event_ingestion(events: int, chunk_size: int) -> dict:
+    message = {"jsonrpc": "2.0", "id": None, "result": {
+        "_type": "EVENT", "emitter": "STREAM", "resourceId": "SourcesService.sourceUpdated",
+        "data": {"sourceId": "wasapi_input_capture_1", "name": "Mic/Aux", "muted": False, "audio": True}}}
+    raw = (json.dumps(message) + "\n").encode() * events
+    chunks = [raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size)]
+
+    connection = pyslobs.SlobsConnection(ChunkTransport(chunks))
+    await connection.connect()
+    subscription = pyslobs.Subscription(connection, "SourcesService.sourceUpdated", maxsize=events)
+    connection.subscriptions[subscription.resource_id] = [subscription]
+    start = time.perf_counter()
+    while await connection.recieve_if_available():
+        pass
+    elapsed = time.perf_counter() - start
+    return {"events": len(subscription.queue), "bytes": len(raw), "elapsed": elapsed,
+            "events_per_sec": len(subscription.queue) / elapsed, "mb_per_sec": len(raw) / elapsed / 1e6}
+
+
+async def bench_wrappers(slobs: pyslobs.Slobs, repeats: int) -> dict:
+    sources = (await slobs.connection.send_and_wait_response("getSources", "SourcesService"))["result"]
+    audio_sources = (await slobs.connection.send_and_wait_response("getSources", "AudioService"))["result"]
+    scenes = (await slobs.connection.send_and_wait_response("getScenes", "ScenesService"))["result"]
+    results = {}
+    # the identity map is opt-in, time it on a connection of its own
+    mapped = pyslobs.SlobsConnection(ChunkTransport([]))
+    mapped.enable_identity_map()
+
+    def best(connection, cls, payload):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            [cls(connection, d) for d in payload]
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    for name, cls, payload in (("Source", pyslobs.Source, sources), ("AudioSource", pyslobs.AudioSource, audio_sources),
+                               ("Scene", pyslobs.Scene, scenes)):
+        count = max(len(payload), 1)
+        # fresh objects, the same with the identity map, and again while the first batch is still alive (map hits)
+        cold = best(slobs.connection, cls, payload)
+        mapped_cold = best(mapped, cls, payload)
+        kept = [cls(mapped, d) for d in payload]
+        reused = best(mapped, cls, payload)
+        del kept
+        results[name] = {"objects": len(payload), "best": cold, "per_object": cold / count,
+                         "identity_map_per_object": mapped_cold / count, "reused_per_object": reused / count}
+
+    start = time.perf_counter()
+    await slobs.get_sources()
+    results["get_sources_round_trip"] = {"objects": len(sources), "elapsed": time.perf_counter() - start}
+    return results
+
+
+async def bench_encoding(iterations: int) -> dict:
+    # time from call to bytes ready for the pipe, for a fresh request and for a prepared one
+    connection = pyslobs.SlobsConnection(ChunkTransport([]))
+    args = ["scene_a3c5e4d2-0f5b-4a1f-9c39-2f3f1d5c6e7a"]
+    prepared = connection.prepare("makeSceneActive", "ScenesService", args)
+    results = {}
+    for name, encode in (("plain", lambda: connection._encode_request("makeSceneActive", "ScenesService", args)),
+                         ("prepared", lambda: prepared.encode(connection._new_request(prepared.method, prepared.resource)))):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            encode()
+        elapsed = time.perf_counter() - start
+        connection.pending_requests.clear()
+        results[name] = {"per_request": elapsed / iterations}
+    return results
+
+
+async def bench_replay(path: str, speed: float) -> dict:
+    # play a recorded session back to a subscribed client, see pyslobs.TrafficReplay
+    replay = pyslobs.TrafficReplay(path)
+    socket_dir = tempfile.mkdtemp(prefix="pyslobs-replay-")
+    try:
+        async with pyslobs.MockSlobsServer(path=os.path.join(socket_dir, "slobs.sock")) as server:
+            replay.install(server)
+            connection = pyslobs.SlobsConnection(server.transport())
+            await connection.connect()
+            loop = asyncio.ensure_future(connection.main_loop())
+            subscriptions = await replay.subscribe(connection, maxsize=2 ** 31)
+            stats = await replay.play(server, speed)
+            # wait for the client to get through the last of it
+            await connection.send_and_wait_response("activeScene", "ScenesService")
+            stats["events"] = sum(len(s.queue) for s in subscriptions)
+            stats["events_per_sec"] = stats["events"] / stats["elapsed"] if stats["elapsed"] > 0 else None
+            await connection.close()
+            await loop
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+    return stats
+
+
+async def run(args) -> dict:
+    socket_dir = tempfile.mkdtemp(prefix="pyslobs-bench-")
+    server = pyslobs.MockSlobsServer(path=os.path.join(socket_dir, "slobs.sock"))
+    server.populate(scenes=args.objects // 10, sources=args.objects, audio_sources=args.objects // 10)
+    results = {}
+    async with server:
+        slobs = pyslobs.Slobs(server.transport())
+        await slobs.start()
+        results["round_trip"] = await bench_round_trip(slobs, args.iterations)
+        results["throughput"] = [await bench_throughput(slobs, callers, args.iterations // callers or 1)
+                                 for callers in args.callers]
+        results["promise_resolution"] = await bench_promises(slobs, args.iterations // 10 or 1)
+        results["wrapper_construction"] = await bench_wrappers(slobs, args.repeats)
+        await slobs.connection.close()
+    shutil.rmtree(socket_dir, ignore_errors=True)
+    results["event_ingestion"] = await bench_event_ingestion(args.events, args.chunk_size)
+    results["request_encoding"] = await bench_encoding(args.events)
+    if args.replay:
+        results["replay"] = await bench_replay(args.replay, args.replay_speed)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=2000, help="requests per latency benchmark")
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 10, 100], help="concurrent caller counts")
+    parser.add_argument("--events", type=int, default=100000, help="events for the ingestion benchmark")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="bytes per simulated read")
+    parser.add_argument("--objects", type=int, default=5000, help="sources in the mock model")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per wrapper construction benchmark")
+    parser.add_argument("--replay", help="also play back this capture file (see SlobsConnection.record)")
+    parser.add_argument("--replay-speed", type=float, default=0, help="replay speed-up, 0 for as fast as possible")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke test")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    if args.quick:
+        args.iterations, args.events, args.objects, args.repeats = 200, 10000, 500, 2
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "parameters": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
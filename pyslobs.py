@@ -4,8 +4,19 @@ import json
 import time
 from pprint import pprint
 import asyncio
-import win32file, win32pipe
-import pywintypes
+import sys
+import uuid
+import bisect
+import weakref
+import random
+import math
+import inspect
+import threading
+import contextvars
+import concurrent.futures
+from array import array
+from functools import lru_cache
+from contextlib import contextmanager
 from typing import NoReturn, Union
 from collections import deque
 from string import ascii_uppercase
@@ -13,11 +24,47 @@ from string import ascii_uppercase
 
 class RequestFailed(Exception):
     def __init__(self, message):
+        super().__init__(message)
         self.message = message
 
+class ConnectionLost(RequestFailed):
+    pass
+
+class RequestTimeout(RequestFailed, asyncio.TimeoutError):
+    pass
+
+# the point in time (time.monotonic) everything in the current context has to be done by, see deadline()
+_deadline = contextvars.ContextVar("pyslobs_deadline", default=None)
+
+@contextmanager
+def deadline(seconds: float):
+    """Every request made inside the block (including from tasks started in it) has to be
+    answered within `seconds` of entering it, or it fails with RequestTimeout.
+
+        with pyslobs.deadline(0.5):
+            await scene.set_active()
+            await mic.set_muted(True)
+
+    Nested deadlines can only make it shorter.
+    """
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current == None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+@lru_cache(maxsize=1024)
 def to_lowercase_with_underscores(s):
     return "".join((c if c not in ascii_uppercase else ("_" + c.lower())) for c in s)
 
+# PerformanceService keys that don't convert nicely on their own
+PERFORMANCE_KEYS = {"CPU": "cpu"}
+
+def performance_key(k):
+    return PERFORMANCE_KEYS.get(k) or to_lowercase_with_underscores(k)
+
 class Promise:
 
     def __init__(self, slobs, data):
@@ -25,195 +72,1868 @@ class Promise:
         self.resource_id = data["result"]["resourceId"]
         self.rejected = None
         self.response = None
+        # resolved by the connection as soon as the fulfilment comes in, even if that already happened
+        self.future = slobs.register_promise(self.resource_id)
 
-    async def get(self) -> Union[dict, None]:
+    async def get(self, timeout: float=None) -> Union[dict, None]:
         # maybe rename?
         # basically wait for the promise to be fulfilled
-        while True:
-            for i, response in enumerate(self.slobs.incoming_queue["fulfilled_promise"]):
-                if response["result"]["resourceId"] == self.resource_id:
-                    self.rejected = response["result"]["isRejected"]
-                    self.response = self.slobs.incoming_queue["fulfilled_promise"].pop(i) if "data" in response["result"] else None
-                    return self.response
-            await asyncio.sleep(0.1)
-
-    async def check_rejected(self) -> bool:
+        if not self.future.done():
+            left = self.slobs._time_left(None)
+            if timeout != None and (left == None or timeout < left):
+                # shielded so this timeout doesn't throw away a fulfilment that's still on its way,
+                # get can be called again later
+                await self.slobs._wait(asyncio.shield(self.future), timeout)
+            else:
+                # out of time for good (connection timeout or deadline) or cancelled,
+                # either way the promise is dropped from the connection's registry
+                await self.slobs._wait(self.future, left)
+        response = self.future.result()
+        self.rejected = response["result"]["isRejected"]
+        self.response = response if "data" in response["result"] else None
+        return self.response
+
+    async def check_rejected(self, timeout: float=None) -> bool:
         if self.rejected == None:
-            await self.get()
+            await self.get(timeout)
         return self.rejected
 
+    def cancel(self) -> None:
+        # stop waiting for this promise and drop it from the connection's registry
+        self.future.cancel()
+
+
+# A write to the key resource type can change what reads from these return (see SlobsConnection.read)
+RELATED_RESOURCES = {
+    "Source": ("Source", "SourcesService", "AudioService"),
+    "AudioSource": ("AudioSource", "AudioService", "SourcesService"),
+    "SourcesService": ("Source", "SourcesService", "AudioSource", "AudioService", "ScenesService"),
+    "AudioService": ("AudioSource", "AudioService"),
+    "ScenesService": ("Scene", "ScenesService", "AudioService"),
+    "Scene": ("Scene", "ScenesService", "AudioService"),
+    "SceneCollectionsService": ("Source", "SourcesService", "AudioSource", "AudioService", "Scene",
+                                "ScenesService", "SceneCollectionsService"),
+}
+
+# Calls that are safe to send again after a reconnect, on top of everything sent through read()
+IDEMPOTENT_METHODS = {
+    "makeSceneActive", "setMuted", "setDeflection", "updateSettings", "setName",
+    "enableStudioMode", "disableStudioMode", "startReplayBuffer", "stopReplayBuffer",
+}
+
+# What happens to requests that were sent but not answered when the connection drops
+RETRY_NONE = "none"
+RETRY_IDEMPOTENT = "idempotent"
+RETRY_ALL = "all"
+
+
+class ReconnectPolicy:
+    """How a SlobsConnection gets back on its feet when SLOBS goes away.
+
+    Connecting is retried with exponential backoff (and a little jitter) up to max_attempts
+    times in a row (forever if None), and `retry` decides which unanswered requests get
+    sent again on the new connection; the rest fail with ConnectionLost.
+    """
+
+    def __init__(self, initial_delay: float=0.5, max_delay: float=30.0, factor: float=2.0,
+                 max_attempts: int=None, retry: str=RETRY_IDEMPOTENT):
+        if retry not in (RETRY_NONE, RETRY_IDEMPOTENT, RETRY_ALL):
+            raise ValueError(f"unknown retry policy {retry!r}")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.max_attempts = max_attempts
+        self.retry = retry
+
+    def delay(self, attempt: int) -> Union[float, None]:
+        """Seconds to wait before the given (0-based) attempt, None once it's time to give up"""
+        if self.max_attempts != None and attempt >= self.max_attempts:
+            return None
+        delay = min(self.max_delay, self.initial_delay * self.factor ** attempt)
+        return delay * random.uniform(0.9, 1.1)
+
+    def should_retry(self, idempotent: bool) -> bool:
+        return self.retry == RETRY_ALL or (self.retry == RETRY_IDEMPOTENT and idempotent)
+
+
+# Priority classes for outgoing requests, lower goes out first
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+
+# What a Subscription does when an event comes in while its queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE_LATEST = "coalesce_latest"
+BLOCK = "block"
+
+
+class Subscription:
+    """A bounded, async-iterable stream of the events SLOBS sends for one resource event.
+
+    With DROP_OLDEST the oldest queued event makes room for the new one, with COALESCE_LATEST
+    only the most recent event is kept, and with BLOCK the connection stops reading until
+    the consumer catches up (which holds up every other response too, so use it sparingly).
+    """
+
+    def __init__(self, connection, resource_id: str, maxsize: int=256, overflow: str=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, COALESCE_LATEST, BLOCK):
+            raise ValueError(f"unknown overflow policy {overflow!r}")
+        self.connection = connection
+        self.resource_id = resource_id
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.queue = deque()
+        self.dropped = 0
+        self.closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def put(self, data) -> bool:
+        """Queue an event, returns True if the reader should wait for room before going on"""
+        if self.closed:
+            return False
+        if self.overflow == COALESCE_LATEST:
+            self.dropped += len(self.queue)
+            self.queue.clear()
+        elif self.overflow == DROP_OLDEST and len(self.queue) >= self.maxsize:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(data)
+        self._readable.set()
+        if self.overflow == BLOCK and len(self.queue) >= self.maxsize:
+            self._writable.clear()
+            return True
+        return False
+
+    async def wait_writable(self) -> None:
+        await self._writable.wait()
+
+    async def get(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self._readable.clear()
+            await self._readable.wait()
+        data = self.queue.popleft()
+        if len(self.queue) < self.maxsize:
+            self._writable.set()
+        return data
+
+    def close(self) -> None:
+        self.closed = True
+        self._readable.set()
+        self._writable.set()
+
+    async def unsubscribe(self) -> None:
+        await self.connection.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class Batch:
+    """Collects calls and sends them to SLOBS in a single write once the `async with` block exits.
+
+    async with connection.batch() as batch:
+        for source in audio_sources:
+            batch.call("setMuted", source.resource_id, [True])
+    print(batch.results)
+    """
+
+    def __init__(self, connection, return_exceptions: bool=False, priority: int=NORMAL):
+        self.connection = connection
+        self.return_exceptions = return_exceptions
+        self.priority = priority
+        self.calls = []
+        self.results = None
+
+    def call(self, method: str, resource: str, args: list=None) -> int:
+        # returns the index of this call's response in results
+        self.calls.append((method, resource, args))
+        return len(self.calls) - 1
+
+    async def send(self) -> list:
+        calls, self.calls = self.calls, []
+        self.results = await self.connection.send_batch(calls, self.return_exceptions, self.priority)
+        return self.results
+
+    async def __aenter__(self) -> "Batch":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type == None:
+            await self.send()
+
+
+class PreparedCall:
+    """A request that's serialized once up front, so sending it only has to fill in a fresh id.
+
+    Meant for hot paths that always send exactly the same thing, like switching to a
+    fixed scene or muting the mic. Calling it sends the request and returns the response:
+
+        go_live = connection.prepare("makeSceneActive", "ScenesService", [scene.id])
+        await go_live()
+    """
+
+    __slots__ = ("connection", "method", "resource", "priority", "idempotent", "after", "_tail")
+
+    def __init__(self, connection, method: str, resource: str, args: list=None, priority: int=NORMAL,
+                 idempotent: bool=None, after=None):
+        self.connection = connection
+        self.method = method
+        self.resource = resource
+        self.priority = priority
+        self.idempotent = idempotent
+        # called with the response after every successful call, e.g. to update a wrapper
+        self.after = after
+        params = {"resource": resource}
+        if args:
+            params["args"] = args
+        # everything after the id, the opening brace is swapped for the part with the id
+        self._tail = bytes(json.dumps({"method": method, "params": params}, ensure_ascii=True)[1:] + "\n", "ascii")
+
+    def encode(self, request_id: int) -> bytes:
+        return b'{"jsonrpc": "2.0", "id": %d, ' % request_id + self._tail
+
+    async def send(self) -> int:
+        connection = self.connection
+        if connection.inflight_reads or connection.read_cache:
+            connection.invalidate(self.resource)
+        request_id = connection._new_request(self.method, self.resource)
+        data = self.encode(request_id)
+        connection._remember_request(request_id, data, self.method, self.priority, self.idempotent)
+        connection._queue(data, [request_id], self.priority)
+        return request_id
+
+    async def __call__(self, timeout: float=None) -> dict:
+        response = await self.connection.wait_for_response(await self.send(), timeout)
+        if self.after != None:
+            self.after(response)
+        return response
+
+
+class MessageFramer:
+    """Splits a byte stream into newline-delimited JSON messages.
+
+    Partial messages are kept in a growable buffer until the rest arrives, and every
+    complete line is decoded exactly once, so huge responses cost O(n) no matter how
+    many reads they are split over.
+    """
+
+    def __init__(self, loads=None):
+        self.buffer = bytearray()
+        # everything in the buffer before this offset is known not to contain a newline
+        self.scanned = 0
+        self.errors = 0
+        # decodes the bytes of one message (e.g. orjson.loads), None uses the json module
+        self.loads = loads
+
+    def feed(self, data: bytes) -> list:
+        buffer = self.buffer
+        buffer += data
+        end = buffer.find(b"\n", self.scanned)
+        if end == -1:
+            self.scanned = len(buffer)
+            return []
+        messages = []
+        start = 0
+        loads = self.loads
+        with memoryview(buffer) as view:
+            while end != -1:
+                if end > start:
+                    try:
+                        if loads == None:
+                            messages.append(json.loads(str(view[start:end], "utf-8")))
+                        else:
+                            messages.append(loads(bytes(view[start:end])))
+                    except ValueError:
+                        # skip the garbled line instead of taking the whole connection down
+                        self.errors += 1
+                start = end + 1
+                end = buffer.find(b"\n", start)
+        del buffer[:start]
+        self.scanned = len(buffer)
+        return messages
+
+
+class Transport:
+    """Base class for the byte streams a SlobsConnection can talk over"""
+
+    async def open(self) -> None:
+        raise NotImplementedError
+
+    async def read(self) -> bytes:
+        """Return the next chunk of available bytes, or b"" once the other end is closed"""
+        raise NotImplementedError
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    async def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class StreamTransport(Transport):
+    """A transport built on top of an asyncio StreamReader/StreamWriter pair"""
+
+    read_size = 262144
 
-class SlobsConnection:
-    
     def __init__(self):
-        self.pipe_handle = None
-        try:
-            self.pipe_handle = win32file.CreateFile(
-                r'\\.\pipe\slobs',
-                win32file.GENERIC_READ | win32file.GENERIC_WRITE,
-                0,
-                None,
-                win32file.OPEN_EXISTING,
-                0,
-                None
-            )
-        except pywintypes.error:
-            print("Error: Streamlabs OBS must be open for this script to work.")
-            exit(1)
+        self.reader = None
+        self.writer = None
+
+    async def read(self) -> bytes:
+        return await self.reader.read(self.read_size)
+
+    def write(self, data: bytes) -> None:
+        self.writer.write(data)
+
+    async def drain(self) -> None:
+        await self.writer.drain()
 
-        self.outgoing_queue = deque()
-        self.incoming_queue = {"helper": [], "subscription": [], "event": [], "promise": [], "fulfilled_promise": []}
+    def close(self) -> None:
+        if self.writer != None:
+            self.writer.close()
+
+
+class NamedPipeTransport(StreamTransport):
+    """The Windows named pipe that SLOBS listens on (needs the default proactor event loop)"""
+
+    def __init__(self, path: str=r'\\.\pipe\slobs'):
+        super().__init__()
+        self.path = path
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        if not hasattr(loop, "create_pipe_connection"):
+            raise OSError("named pipes are only available with the Windows proactor event loop")
+        self.reader = asyncio.StreamReader(limit=self.read_size)
+        protocol = asyncio.StreamReaderProtocol(self.reader)
+        transport, _ = await loop.create_pipe_connection(lambda: protocol, self.path)
+        self.writer = asyncio.StreamWriter(transport, protocol, self.reader, loop)
+
+
+class UnixSocketTransport(StreamTransport):
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    async def open(self) -> None:
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+
+
+class TCPTransport(StreamTransport):
+
+    def __init__(self, host: str="127.0.0.1", port: int=28194):
+        super().__init__()
+        self.host = host
+        self.port = port
+
+    async def open(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+
+def default_transport() -> Transport:
+    if sys.platform == "win32":
+        return NamedPipeTransport()
+    # SLOBS itself only runs on Windows, but this lets a stand-in server be used elsewhere
+    return UnixSocketTransport("/tmp/slobs.sock")
+
+
+class TrafficRecorder:
+    """Appends everything sent to and read from SLOBS to a capture file, see SlobsConnection.record.
+
+    Each session starts with a `pyslobs-capture 1 <unix time>` line, followed by one record
+    per write or read: a `> <seconds> <length>` (sent) or `< <seconds> <length>` (received)
+    line, the raw bytes exactly as they went over the pipe, and a newline. Times are
+    relative to the start of the session. TrafficReplay plays these back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "ab")
+        self.start = time.monotonic()
+        self.file.write(b"pyslobs-capture 1 %.6f\n" % time.time())
+
+    def record(self, direction: bytes, data: bytes) -> None:
+        if self.file.closed:
+            # a read that was still in flight when the connection closed
+            return
+        self.file.write(b"%s %.6f %d\n" % (direction, time.monotonic() - self.start, len(data)))
+        self.file.write(data)
+        self.file.write(b"\n")
+
+    def sent(self, data: bytes) -> None:
+        self.record(b">", data)
+
+    def received(self, data: bytes) -> None:
+        self.record(b"<", data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_capture(path: str):
+    """Yield (direction, seconds, data) for every record in a capture file, direction being
+    ">" or "<". Sessions appended to the same file follow on from each other, and a record
+    cut off at the end (the recording process got killed) ends it like the end of the file."""
+    offset = 0.0
+    last = 0.0
+    with open(path, "rb") as f:
+        while True:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                return
+            fields = header.split()
+            if fields and fields[0] == b"pyslobs-capture":
+                offset = last
+                continue
+            try:
+                direction, seconds, length = fields[0].decode(), float(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                return
+            data = f.read(length)
+            if len(data) < length or f.read(1) != b"\n":
+                return
+            last = offset + seconds
+            yield direction, last, data
+
+
+class RecordingTransport(Transport):
+    """Wraps another transport and hands everything going through it to a TrafficRecorder"""
+
+    def __init__(self, transport: Transport, recorder: TrafficRecorder):
+        self.transport = transport
+        self.recorder = recorder
+
+    async def open(self) -> None:
+        await self.transport.open()
+
+    async def read(self) -> bytes:
+        data = await self.transport.read()
+        if data:
+            self.recorder.received(data)
+        return data
+
+    def write(self, data: bytes) -> None:
+        self.transport.write(data)
+        self.recorder.sent(data)
+
+    async def drain(self) -> None:
+        await self.transport.drain()
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class LatencyHistogram:
+    """A fixed-bucket histogram of durations in seconds (buckets double from 10 microseconds up)"""
+
+    bounds = [0.00001 * 2 ** i for i in range(22)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> Union[float, None]:
+        # upper bound of the bucket the p-th percentile falls in, clamped to the observed range
+        if self.count == 0:
+            return None
+        target = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                bound = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count, "mean": self.total / self.count if self.count else None,
+            "min": self.min, "max": self.max,
+            "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+        }
+
+
+class MetricsExporter:
+    """Receives measurements from a SlobsConnection, override whichever hooks you need.
+
+    Pass one as SlobsConnection(metrics=...); without one the connection skips all of this.
+    """
+
+    def bind(self, connection) -> None:
+        pass
+
+    def request_written(self, queue_delay: float) -> None:
+        # time a queued write spent in outgoing_queue before going out
+        pass
+
+    def data_sent(self, nbytes: int, write_time: float) -> None:
+        pass
+
+    def data_received(self, nbytes: int, messages: int, decode_time: float) -> None:
+        pass
+
+    def response_received(self, method: str, resource: str, latency: float, failed: bool) -> None:
+        pass
+
+
+class ConnectionMetrics(MetricsExporter):
+    """Keeps latency histograms per method and resource type plus traffic counters in memory"""
+
+    def __init__(self):
+        self.connection = None
+        self.reset()
+
+    def bind(self, connection) -> None:
+        self.connection = connection
+
+    def reset(self) -> None:
+        self.started = time.perf_counter()
+        # (resource type, method) -> LatencyHistogram, resource ids like Source["..."] count as "Source"
+        self.latency = {}
+        self.queue_delay = LatencyHistogram()
+        self.write_time = LatencyHistogram()
+        self.decode_time = LatencyHistogram()
+        self.failures = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.writes = 0
+        self.messages_in = 0
+        self.responses = 0
+
+    def request_written(self, queue_delay: float) -> None:
+        self.queue_delay.record(queue_delay)
+
+    def data_sent(self, nbytes: int, write_time: float) -> None:
+        self.bytes_out += nbytes
+        self.writes += 1
+        self.write_time.record(write_time)
+
+    def data_received(self, nbytes: int, messages: int, decode_time: float) -> None:
+        self.bytes_in += nbytes
+        self.messages_in += messages
+        self.decode_time.record(decode_time)
+
+    def response_received(self, method: str, resource: str, latency: float, failed: bool) -> None:
+        key = (resource.split("[", 1)[0], method)
+        histogram = self.latency.get(key)
+        if histogram == None:
+            histogram = self.latency[key] = LatencyHistogram()
+        histogram.record(latency)
+        self.responses += 1
+        if failed:
+            self.failures += 1
+
+    def snapshot(self) -> dict:
+        """Everything collected so far as plain, JSON-serializable data"""
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        snapshot = {
+            "elapsed": elapsed,
+            "latency": {f"{resource}.{method}": h.summary() for (resource, method), h in self.latency.items()},
+            "queue_delay": self.queue_delay.summary(),
+            "write_time": self.write_time.summary(),
+            "decode_time": self.decode_time.summary(),
+            "responses": self.responses,
+            "failures": self.failures,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "messages_in": self.messages_in,
+            "messages_in_per_sec": self.messages_in / elapsed,
+            "responses_per_sec": self.responses / elapsed,
+        }
+        if self.connection != None:
+            snapshot["in_flight"] = len(self.connection.pending_requests)
+            snapshot["outgoing_queue"] = len(self.connection.outgoing_queue)
+            snapshot["event_queues"] = {
+                resource_id: sum(len(sub.queue) for sub in subscribers)
+                for resource_id, subscribers in self.connection.subscriptions.items()
+            }
+        return snapshot
+
+
+class PriorityLimit:
+    """Caps how many requests of one priority class can be in flight, and/or how many go out per second"""
+
+    def __init__(self, max_in_flight: int=None, rate: float=None, burst: int=1):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.in_flight = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> Union[float, None]:
+        """0 if a request may go out now, otherwise seconds to wait (None means until one finishes)"""
+        if self.max_in_flight != None and self.in_flight >= self.max_in_flight:
+            return None
+        if self.rate != None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+        return 0
+
+    def take(self, count: int) -> None:
+        self.in_flight += count
+        self.tokens -= count
+
+
+class RequestScheduler:
+    """The outgoing queue of a SlobsConnection, one FIFO per priority class.
+
+    Whatever is ready in a higher priority class always goes out before anything lower,
+    and classes with a PriorityLimit are held back once they hit it. By default background
+    requests are limited to 4 in flight so polling can't flood the pipe.
+    """
+
+    def __init__(self, limits: dict=None):
+        self.queues = {INTERACTIVE: deque(), NORMAL: deque(), BACKGROUND: deque()}
+        self.limits = {BACKGROUND: PriorityLimit(max_in_flight=4)} if limits == None else dict(limits)
+        # seconds until a rate limited class can send again, None if nothing is waiting on a rate
+        self.retry_after = None
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def append(self, item: tuple, priority: int=NORMAL) -> None:
+        # item is (data, request ids, time queued or None)
+        self.queues[priority].append(item)
+
+    def tracks_in_flight(self, priority: int) -> bool:
+        limit = self.limits.get(priority)
+        return limit != None and limit.max_in_flight != None
+
+    def finished(self, priority: int) -> None:
+        self.limits[priority].in_flight -= 1
+
+    def pop_ready(self) -> Union[tuple, None]:
+        self.retry_after = None
+        now = time.monotonic()
+        for priority, queue in self.queues.items():
+            if not queue:
+                continue
+            limit = self.limits.get(priority)
+            if limit != None:
+                delay = limit.delay(now)
+                if delay != 0:
+                    if delay != None and (self.retry_after == None or delay < self.retry_after):
+                        self.retry_after = delay
+                    continue
+                limit.take(len(queue[0][1]))
+            return queue.popleft()
+        return None
+
+
+class SlobsConnection:
+    
+    def __init__(self, transport: Transport=None, metrics: MetricsExporter=None, scheduler: RequestScheduler=None,
+                 reconnect: ReconnectPolicy=None, timeout: float=None):
+        self.transport = transport if transport != None else default_transport()
+        # default for how long to wait for a response (None waits forever), see also deadline()
+        self.timeout = timeout
+        # without a policy a dropped connection just fails everything that's pending
+        self.reconnect = reconnect
+        # only filled in with a reconnect policy: request id -> (data, priority, idempotent)
+        self.sent_requests = {}
+        # coroutine functions awaited after every successful reconnect
+        self.reconnect_callbacks = []
+        self.metrics = metrics
+        # only filled in when metrics are enabled: request id -> (method, resource, time sent)
+        self.request_info = {}
+        if metrics != None:
+            metrics.bind(self)
+        self.connected = False
+        # pluggable decoder for incoming messages, see MessageFramer
+        self.loads = None
+        self.framer = MessageFramer()
+        # read() bookkeeping: (method, resource, args) -> [future, waiters] shared by identical calls in flight,
+        # and -> (expiry, response) for the optional short-lived cache (off while read_cache_ttl is 0)
+        self.inflight_reads = {}
+        self.read_cache = {}
+        self.read_cache_ttl = 0.0
+        self._cache_generation = 0
+        # (wrapper class, resource id) -> weak reference to the live wrapper for it, see SlobsObject.
+        # None (the default) until enable_identity_map is called
+        self.objects = None
+        self.outgoing_queue = scheduler if scheduler != None else RequestScheduler()
+        # request id -> priority, for the classes the scheduler caps in-flight requests of
+        self.request_priority = {}
+        # event resource id (e.g. "ScenesService.sceneSwitched") -> list of Subscription
+        self.subscriptions = {}
+        # BLOCK subscriptions that filled up while dispatching, the reader waits on these
+        self.backpressure = []
+        # request id -> future that gets resolved as soon as the response is parsed
+        self.pending_requests = {}
+        # resolved futures nobody has called wait_for_response for yet, oldest first
+        self.early_responses = {}
+        self.max_early_responses = 1024
+        # promise resource id -> future that gets resolved with the fulfilment
+        self.promises = {}
+        # fulfilments that came in before their Promise was registered, oldest first
+        self.early_promises = {}
+        self.max_early_promises = 1024
         self.current_id = 1
         self.running = True
+        self._wakeup = None
 
-    def __del__(self):
-        win32file.CloseHandle(self.pipe_handle)
+    async def connect(self) -> None:
+        if self.connected:
+            return
+        attempt = 0
+        while True:
+            try:
+                await self.transport.open()
+                break
+            except OSError as e:
+                delay = self.reconnect.delay(attempt) if self.reconnect != None and self.running else None
+                if delay == None:
+                    raise ConnectionLost("could not connect to Streamlabs OBS, make sure it's open") from e
+                attempt += 1
+                await asyncio.sleep(delay)
+        self.connected = True
+        self.framer = MessageFramer(self.loads)
+        if self._wakeup == None:
+            self._wakeup = asyncio.Event()
+        if self.outgoing_queue:
+            self._wakeup.set()
     
-    async def recieve_if_available(self) -> None:
-        raw = b""
-        # Only recieve data if there is data available in the pipe
-        while win32pipe.PeekNamedPipe(self.pipe_handle, 0)[1] != 0:
-            raw += win32file.ReadFile(self.pipe_handle, 1024)[1]
-        if raw == b"": return
-        # Split the raw bytes into seperate messages if possible, add to queue
-        for response in [r for r in raw.split(b"\n") if r != b""]:
-            json_data = json.loads(str(response, "ascii"))
-            result = json_data["result"]
-            if isinstance(result, dict):
-                # promises and subscriptions are basically two different things using the same format, separate them here
-                if result["_type"] == "HELPER":
-                    # idk if this even happens ever
-                    self.incoming_queue["helper"].append(json_data)
-                elif result["_type"] == "SUBSCRIPTION":
-                    if result["emitter"] == "STREAM":
-                        self.incoming_queue["subscription"].append(json_data)
-                    if result["emitter"] == "PROMISE":
-                        self.incoming_queue["promise"].append(json_data)
-                elif result["_type"] == "EVENT":
-                    if result["emitter"] == "STREAM":
-                        self.incoming_queue["event"].append(json_data)
-                    if result["emitter"] == "PROMISE":
-                        self.incoming_queue["fulfilled_promise"].append(json_data)
-            else:
-                # the result is probably supposed to be a helper
-                self.incoming_queue["helper"].append(json_data)
+    async def recieve_if_available(self) -> bool:
+        # Wait for the next chunk of data, returns False once the connection is gone
+        raw = await self.transport.read()
+        if raw == b"":
+            return False
+        # Responses can be split across reads, the framer holds on to partial ones
+        if self.metrics != None:
+            start = time.perf_counter()
+            messages = self.framer.feed(raw)
+            self.metrics.data_received(len(raw), len(messages), time.perf_counter() - start)
+        else:
+            messages = self.framer.feed(raw)
+        for message in messages:
+            self.dispatch_message(message)
+            while self.backpressure:
+                await self.backpressure.pop().wait_writable()
+        return True
+
+    def dispatch_message(self, json_data: dict) -> None:
+        result = json_data.get("result")
+        if isinstance(result, dict) and result.get("_type") == "EVENT":
+            if result["emitter"] == "STREAM":
+                # events nobody subscribed to are simply dropped
+                for subscription in self.subscriptions.get(result["resourceId"], ()):
+                    if subscription.put(result.get("data")):
+                        self.backpressure.append(subscription)
+            elif result["emitter"] == "PROMISE":
+                self.fulfill_promise(result["resourceId"], json_data)
+            return
+        # everything else (helpers, subscription/promise handles) is a direct response to a request
+        if self.request_priority:
+            # even when nobody is waiting anymore it doesn't count against the cap now
+            self._request_finished(json_data.get("id"))
+        future = self.pending_requests.get(json_data.get("id"))
+        if future is None or future.done():
+            # nobody is waiting for this one anymore
+            return
+        if self.sent_requests:
+            self.sent_requests.pop(json_data["id"], None)
+        if self.metrics != None and json_data["id"] in self.request_info:
+            method, resource, sent = self.request_info.pop(json_data["id"])
+            self.metrics.response_received(method, resource, time.perf_counter() - sent, "error" in json_data)
+        if "error" in json_data:
+            future.set_exception(RequestFailed(json_data["error"].get("message", "request failed")))
+        else:
+            future.set_result(json_data)
+        self._delivered(json_data["id"], future)
+
+    def _delivered(self, request_id: int, future: asyncio.Future) -> None:
+        # a waiter already holds the future, otherwise it's kept (bounded) for a later wait_for_response
+        del self.pending_requests[request_id]
+        self.early_responses[request_id] = future
+        if len(self.early_responses) > self.max_early_responses:
+            oldest = self.early_responses.pop(next(iter(self.early_responses)))
+            if not oldest.cancelled():
+                # nobody is going to look at it, keep asyncio from complaining about it
+                oldest.exception()
     
-    async def send_request(self, method: str, resource: str, args: list=None) -> int:
+    def fulfill_promise(self, resource_id: str, json_data: dict) -> None:
+        future = self.promises.get(resource_id)
+        if future == None:
+            # the fulfilment beat the promise handle, keep it around until someone registers for it
+            self.early_promises[resource_id] = json_data
+            if len(self.early_promises) > self.max_early_promises:
+                del self.early_promises[next(iter(self.early_promises))]
+        elif not future.done():
+            future.set_result(json_data)
+
+    def register_promise(self, resource_id: str) -> asyncio.Future:
+        future = self.promises.get(resource_id)
+        if future != None:
+            return future
+        future = asyncio.get_running_loop().create_future()
+        if resource_id in self.early_promises:
+            future.set_result(self.early_promises.pop(resource_id))
+        else:
+            self.promises[resource_id] = future
+            future.add_done_callback(lambda f: self.promises.pop(resource_id, None))
+        return future
+
+    def enable_identity_map(self) -> None:
+        # costs a weak reference and a dict entry per wrapper, so it's only on when asked for
+        if self.objects == None:
+            self.objects = {}
+
+    def _forget_object(self, ref: weakref.ref) -> None:
+        # called when a wrapper in the identity map gets garbage collected
+        if self.objects.get(ref.key) is ref:
+            del self.objects[ref.key]
+
+    def _new_request(self, method: str, resource: str) -> int:
+        if not self.running:
+            raise ConnectionLost("connection to Streamlabs OBS is closed")
+        end = _deadline.get()
+        if end != None and end <= time.monotonic():
+            # don't bother sending something nobody is going to wait for
+            raise RequestTimeout("deadline passed before the request was sent")
         request_id = self.current_id
         self.current_id += 1
+        # register the future before the request goes out so the response can't be missed
+        self.pending_requests[request_id] = asyncio.get_running_loop().create_future()
+        if self.metrics != None:
+            self.request_info[request_id] = (method, resource, time.perf_counter())
+        return request_id
+
+    def _remember_request(self, request_id: int, data: bytes, method: str, priority: int, idempotent: bool=None) -> None:
+        # keep what's needed to send it again after a reconnect
+        if self.reconnect != None:
+            if idempotent == None:
+                idempotent = method in IDEMPOTENT_METHODS
+            self.sent_requests[request_id] = (data, priority, idempotent)
+
+    def _encode_request(self, method: str, resource: str, args: list=None, priority: int=NORMAL,
+                        idempotent: bool=None) -> tuple:
+        request_id = self._new_request(method, resource)
         to_send = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": {"resource": resource}}
         if args:
             to_send["params"]["args"] = args
-        self.outgoing_queue.append(bytes(json.dumps(to_send, ensure_ascii=True), "ascii"))
+        data = bytes(json.dumps(to_send, ensure_ascii=True) + "\n", "ascii")
+        self._remember_request(request_id, data, method, priority, idempotent)
+        return request_id, data
+
+    def _queue(self, data: bytes, request_ids: list, priority: int) -> None:
+        if self.outgoing_queue.tracks_in_flight(priority):
+            for request_id in request_ids:
+                self.request_priority[request_id] = priority
+        queued_at = time.perf_counter() if self.metrics != None else None
+        self.outgoing_queue.append((data, request_ids, queued_at), priority)
+        if self._wakeup != None:
+            self._wakeup.set()
+
+    def _unqueue(self, request_id: int) -> bool:
+        # take a request nobody waits for anymore out of the outgoing queue, False if it was already sent
+        for queue in self.outgoing_queue.queues.values():
+            for item in queue:
+                if request_id not in item[1]:
+                    continue
+                if not any(r_id in self.pending_requests for r_id in item[1]):
+                    # the whole write was given up on (a batch is only dropped once all of it is)
+                    queue.remove(item)
+                    for r_id in item[1]:
+                        self.request_priority.pop(r_id, None)
+                return True
+        return False
+
+    def _request_finished(self, request_id: int) -> None:
+        priority = self.request_priority.pop(request_id, None)
+        if priority != None:
+            self.outgoing_queue.finished(priority)
+            # something held back by an in-flight cap might be able to go now
+            if self._wakeup != None:
+                self._wakeup.set()
+
+    async def send_request(self, method: str, resource: str, args: list=None, priority: int=NORMAL) -> int:
+        if self.inflight_reads or self.read_cache:
+            # anything that doesn't go through read() might change what reads return
+            self.invalidate(resource)
+        request_id, data = self._encode_request(method, resource, args, priority)
+        self._queue(data, [request_id], priority)
         return request_id
 
-    async def wait_for_response(self, request_id: int) -> dict:
-        while True:
-            for i, response in enumerate(self.incoming_queue["helper"]):
-                if response["id"] == request_id:
-                    return self.incoming_queue["helper"].pop(i)
-            await asyncio.sleep(0.1)
+    async def read(self, method: str, resource: str, args: list=None, priority: int=NORMAL, ttl: float=None,
+                   timeout: float=None) -> dict:
+        """send_and_wait_response for calls that don't change anything.
+
+        Identical calls that are already in flight share a single request, and with a ttl
+        (or read_cache_ttl) the response is reused until it expires or a related write
+        invalidates it. The response dict is shared between callers, so don't modify it.
+        """
+        key = (method, resource, json.dumps(args) if args else None)
+        ttl = self.read_cache_ttl if ttl == None else ttl
+        if ttl > 0:
+            cached = self.read_cache.get(key)
+            if cached != None and cached[0] > time.monotonic():
+                return cached[1]
+        # [shared future, number of callers waiting on it]
+        entry = self.inflight_reads.get(key)
+        if entry == None:
+            request_id, data = self._encode_request(method, resource, args, priority, idempotent=True)
+            self._queue(data, [request_id], priority)
+            # only the connection-wide timeout applies to the shared request, the callers' own
+            # timeouts and deadlines just limit how long each of them waits for it
+            future = asyncio.ensure_future(self._wait_for_response(request_id, self.timeout))
+            entry = self.inflight_reads[key] = [future, 0]
+            generation = self._cache_generation
+            future.add_done_callback(lambda f: self._read_done(key, f, ttl, generation))
+        future = entry[0]
+        entry[1] += 1
+        try:
+            # shielded so one caller giving up doesn't cancel it for everyone else
+            return await self._wait(asyncio.shield(future), self._time_left(timeout))
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not future.done():
+                # everyone gave up on it, don't leave the request hanging around. forgotten right away
+                # so a retry starts a new request instead of joining the cancelled one
+                if self.inflight_reads.get(key) is entry:
+                    del self.inflight_reads[key]
+                future.cancel()
+
+    def _read_done(self, key: tuple, future: asyncio.Future, ttl: float, generation: int) -> None:
+        entry = self.inflight_reads.get(key)
+        if entry != None and entry[0] is future:
+            del self.inflight_reads[key]
+        # only cache it if nothing was written in the meantime
+        if ttl > 0 and generation == self._cache_generation and not future.cancelled() and future.exception() == None:
+            self.read_cache[key] = (time.monotonic() + ttl, future.result())
+
+    def invalidate(self, resource: str=None) -> None:
+        """Forget cached and shared in-flight reads for `resource` and the services related to it, or all of them"""
+        self._cache_generation += 1
+        if resource == None:
+            self.read_cache.clear()
+            self.inflight_reads.clear()
+            return
+        resource_type = resource.split("[", 1)[0]
+        related = RELATED_RESOURCES.get(resource_type)
+        if related == None:
+            related = (resource_type,)
+        for entries in (self.read_cache, self.inflight_reads):
+            for key in [k for k in entries if k[1] == resource or k[1].split("[", 1)[0] in related]:
+                del entries[key]
+
+    async def send_batch(self, calls: list, return_exceptions: bool=False, priority: int=NORMAL,
+                         timeout: float=None) -> list:
+        """Send (method, resource, args) calls in one write and return their responses in order"""
+        request_ids = []
+        chunks = []
+        for call in calls:
+            if self.inflight_reads or self.read_cache:
+                self.invalidate(call[1])
+            request_id, data = self._encode_request(*call, priority=priority)
+            request_ids.append(request_id)
+            chunks.append(data)
+        if chunks:
+            self._queue(b"".join(chunks), request_ids, priority)
+        timeout = self._time_left(timeout)
+        return await asyncio.gather(*(self._wait_for_response(r_id, timeout) for r_id in request_ids),
+                                    return_exceptions=return_exceptions)
+
+    def batch(self, return_exceptions: bool=False, priority: int=NORMAL) -> "Batch":
+        return Batch(self, return_exceptions, priority)
+
+    def prepare(self, method: str, resource: str, args: list=None, priority: int=NORMAL, idempotent: bool=None,
+                after=None) -> PreparedCall:
+        return PreparedCall(self, method, resource, args, priority, idempotent, after)
+
+    def record(self, path: str) -> TrafficRecorder:
+        """Start appending all traffic on this connection to the capture file at `path`"""
+        self.stop_recording()
+        recorder = TrafficRecorder(path)
+        self.transport = RecordingTransport(self.transport, recorder)
+        return recorder
+
+    def stop_recording(self) -> None:
+        if isinstance(self.transport, RecordingTransport):
+            self.transport.recorder.close()
+            self.transport = self.transport.transport
+
+    def _time_left(self, timeout: float=None) -> Union[float, None]:
+        # how long a caller may wait: its own timeout (or the connection's), cut short by any deadline
+        if timeout == None:
+            timeout = self.timeout
+        end = _deadline.get()
+        if end != None:
+            left = end - time.monotonic()
+            timeout = left if timeout == None else min(timeout, left)
+        return timeout
+
+    async def _wait(self, awaitable, timeout: Union[float, None]):
+        if timeout == None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(timeout, 0))
+        except RequestTimeout:
+            raise
+        except asyncio.TimeoutError:
+            raise RequestTimeout(f"no response from Streamlabs OBS within {max(timeout, 0):.3g}s") from None
+
+    async def wait_for_response(self, request_id: int, timeout: float=None) -> dict:
+        return await self._wait_for_response(request_id, self._time_left(timeout))
+
+    async def _wait_for_response(self, request_id: int, timeout: Union[float, None]) -> dict:
+        # whichever way this ends (response, timeout, cancelled caller) the request is forgotten
+        future = self.pending_requests.get(request_id)
+        if future == None:
+            future = self.early_responses.get(request_id)
+            if future == None:
+                raise RequestFailed(f"no response for request {request_id} to wait for, it was never sent, "
+                                    "already waited for or dropped after max_early_responses")
+        try:
+            return await self._wait(future, timeout)
+        finally:
+            self.pending_requests.pop(request_id, None)
+            self.early_responses.pop(request_id, None)
+            if future.cancelled() and self._unqueue(request_id):
+                # it never went out, so it neither gets sent now nor counts as finished
+                pass
+            elif self.request_priority:
+                self._request_finished(request_id)
+            if self.sent_requests:
+                self.sent_requests.pop(request_id, None)
+            if self.metrics != None:
+                self.request_info.pop(request_id, None)
+
+    async def send_and_wait_response(self, method: str, resource: str, args: list=None, priority: int=NORMAL,
+                                     timeout: float=None) -> dict:
+        r_id = await self.send_request(method, resource, args, priority)
+        return await self.wait_for_response(r_id, timeout)
+
+    async def wait_for_promise(self, request_id: int, timeout: float=None) -> Promise:
+        return Promise(self, await self.wait_for_response(request_id, timeout))
+
+    async def send_and_wait_promise(self, method: str, resource: str, args: list=None, priority: int=NORMAL,
+                                    timeout: float=None) -> Promise:
+        r_id = await self.send_request(method, resource, args, priority)
+        return await self.wait_for_promise(r_id, timeout)
+
+    async def subscribe(self, resource: str, event: str, maxsize: int=256, overflow: str=DROP_OLDEST) -> Subscription:
+        resource_id = f"{resource}.{event}"
+        subscription = Subscription(self, resource_id, maxsize, overflow)
+        # register before asking so no event sent right after the response gets lost
+        subscribers = self.subscriptions.setdefault(resource_id, [])
+        subscribers.append(subscription)
+        if len(subscribers) == 1:
+            try:
+                response = await self.send_and_wait_response(event, resource)
+            except BaseException:
+                self._remove_subscription(subscription)
+                raise
+            actual_id = response["result"]["resourceId"]
+            if actual_id != resource_id:
+                self._remove_subscription(subscription)
+                subscription.resource_id = actual_id
+                self.subscriptions.setdefault(actual_id, []).append(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        if self._remove_subscription(subscription):
+            await self.send_and_wait_response("unsubscribe", subscription.resource_id)
+
+    def _remove_subscription(self, subscription: Subscription) -> bool:
+        # returns True if that was the last subscriber for its resource
+        subscribers = self.subscriptions.get(subscription.resource_id, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+        if subscribers:
+            return False
+        self.subscriptions.pop(subscription.resource_id, None)
+        return True
 
-    async def send_and_wait_response(self, method: str, resource: str, args: list=None) -> dict:
-        r_id = await self.send_request(method, resource, args)
-        return await self.wait_for_response(r_id)
+    async def close(self) -> None:
+        self.running = False
+        self.transport.close()
+        self.stop_recording()
 
-    async def wait_for_promise(self, request_id: int) -> Promise:
-        while True:
-            for i, response in enumerate(self.incoming_queue["promise"]):
-                if response["id"] == request_id:
-                    return Promise(self, self.incoming_queue["promise"].pop(i))
-            await asyncio.sleep(0.1)
+    async def write_loop(self) -> NoReturn:
+        try:
+            while self.running:
+                self._wakeup.clear()
+                await self.flush()
+                if self.outgoing_queue.retry_after != None:
+                    # a rate limited class has something waiting, come back when it's allowed to go
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.outgoing_queue.retry_after)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._wakeup.wait()
+        except (ConnectionError, OSError):
+            # closing the transport wakes the reader up so the main loop notices
+            self.transport.close()
+
+    async def flush(self) -> None:
+        # Send everything the scheduler lets through, highest priority first
+        start = time.perf_counter() if self.metrics != None else None
+        nbytes = 0
+        while (item := self.outgoing_queue.pop_ready()) != None:
+            data, request_ids, queued_at = item
+            if queued_at != None and self.metrics != None:
+                self.metrics.request_written(start - queued_at)
+            self.transport.write(data)
+            nbytes += len(data)
+        await self.transport.drain()
+        if nbytes and self.metrics != None:
+            self.metrics.data_sent(nbytes, time.perf_counter() - start)
 
-    async def send_and_wait_promise(self, method: str, resource: str, args: list=None) -> Promise:
-        r_id = await self.send_request(method, resource, args)
-        return await self.wait_for_promise(r_id)
+    async def main_loop(self) -> NoReturn:
+        try:
+            await self.connect()
+            while self.running:
+                writer = asyncio.ensure_future(self.write_loop())
+                try:
+                    while self.running:
+                        if not await self.recieve_if_available():
+                            break
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    writer.cancel()
+                    self.transport.close()
+                    self.connected = False
+                if not self.running or self.reconnect == None:
+                    break
+                self._connection_dropped()
+                try:
+                    await self.connect()
+                except ConnectionLost:
+                    # out of attempts, give up for good
+                    break
+                asyncio.ensure_future(self._after_reconnect())
+        finally:
+            self.running = False
+            self.connected = False
+            self.stop_recording()
+            self._fail_pending(ConnectionLost("connection to Streamlabs OBS closed"))
+
+    def _connection_dropped(self) -> None:
+        # sort out what was waiting on the old connection: retry what the policy allows, fail the rest
+        lost = ConnectionLost("connection to Streamlabs OBS lost")
+        queued = {r_id for queue in self.outgoing_queue.queues.values() for item in queue for r_id in item[1]}
+        resend = []
+        for request_id, future in list(self.pending_requests.items()):
+            if request_id in queued or future.done():
+                continue
+            data, priority, idempotent = self.sent_requests.get(request_id, (None, NORMAL, False))
+            if data != None and self.reconnect.should_retry(idempotent):
+                resend.append((request_id, data, priority))
+            else:
+                future.set_exception(lost)
+                self.sent_requests.pop(request_id, None)
+                self.request_info.pop(request_id, None)
+                self._delivered(request_id, future)
+        # promises and subscriptions don't survive SLOBS going away
+        for future in list(self.promises.values()):
+            if not future.done():
+                future.set_exception(lost)
+        self.early_promises.clear()
+        self.invalidate()
+        # in-flight caps start over on the new connection
+        for limit in self.outgoing_queue.limits.values():
+            limit.in_flight = 0
+        self.request_priority.clear()
+        for request_id, data, priority in resend:
+            self._queue(data, [request_id], priority)
+
+    async def _after_reconnect(self) -> None:
+        for resource_id in list(self.subscriptions):
+            resource, event = resource_id.rsplit(".", 1)
+            try:
+                await self.send_and_wait_response(event, resource)
+            except RequestFailed:
+                pass
+        for callback in list(self.reconnect_callbacks):
+            try:
+                await callback()
+            except RequestFailed:
+                # most likely the connection dropped again, the next reconnect will call it again
+                pass
+
+    def _fail_pending(self, exception: Exception) -> None:
+        for future in list(self.pending_requests.values()) + list(self.promises.values()):
+            if not future.done():
+                future.set_exception(exception)
+        for subscribers in list(self.subscriptions.values()):
+            for subscription in subscribers:
+                subscription.close()
+
+
+class StateMirror:
+    """An in-memory copy of the scenes, sources and audio sources, kept current from SLOBS events.
+
+    Enable it through Slobs.enable_state_cache(); after that the scene/source/audio source
+    getters on Slobs are answered from here without any IPC.
+    """
+
+    events = (
+        ("ScenesService", "sceneAdded"), ("ScenesService", "sceneRemoved"), ("ScenesService", "sceneSwitched"),
+        ("SourcesService", "sourceAdded"), ("SourcesService", "sourceRemoved"), ("SourcesService", "sourceUpdated"),
+    )
+
+    def __init__(self, connection: SlobsConnection):
+        self.connection = connection
+        # id -> object, and name -> list of objects (names don't have to be unique)
+        self.scenes = {}
+        self.scenes_by_name = {}
+        self.sources = {}
+        self.sources_by_name = {}
+        self.audio_sources = {}
+        self.audio_sources_by_name = {}
+        self.active_scene_id = None
+        self.subscriptions = []
+        self.tasks = []
+        # audio sources that were added and still need their AudioSource model fetched
+        self.pending_audio = set()
+        self._audio_task = None
+        self._reload_task = None
+
+    async def start(self) -> None:
+        handlers = {
+            "sceneAdded": self.on_scene_added, "sceneRemoved": self.on_scene_removed,
+            "sceneSwitched": self.on_scene_switched, "sourceAdded": self.on_source_added,
+            "sourceRemoved": self.on_source_removed, "sourceUpdated": self.on_source_updated,
+        }
+        # subscribe before loading so nothing that happens in between gets missed. Never BLOCK here,
+        # the handlers send requests and a blocked reader would never see the responses, missed
+        # events are made up for with a reload instead
+        for resource, event in self.events:
+            subscription = await self.connection.subscribe(resource, event, maxsize=1024, overflow=DROP_OLDEST)
+            self.subscriptions.append(subscription)
+            self.tasks.append(asyncio.ensure_future(self._apply_events(subscription, handlers[event])))
+        await self.reload()
+        self.connection.reconnect_callbacks.append(self.reload)
+
+    async def stop(self) -> None:
+        if self.reload in self.connection.reconnect_callbacks:
+            self.connection.reconnect_callbacks.remove(self.reload)
+        for task in self.tasks + [self._audio_task, self._reload_task]:
+            if task != None:
+                task.cancel()
+        self._audio_task = self._reload_task = None
+        self.pending_audio.clear()
+        for subscription in self.subscriptions:
+            await subscription.unsubscribe()
+        self.tasks = []
+        self.subscriptions = []
+
+    async def reload(self) -> None:
+        scenes, active_scene, sources, audio_sources = await asyncio.gather(
+            self.connection.send_and_wait_response("getScenes", "ScenesService"),
+            self.connection.send_and_wait_response("activeScene", "ScenesService"),
+            self.connection.send_and_wait_response("getSources", "SourcesService"),
+            self.connection.send_and_wait_response("getSources", "AudioService"),
+        )
+        self.scenes, self.scenes_by_name = {}, {}
+        for d in scenes["result"]:
+            self._add(self.scenes, self.scenes_by_name, d["id"], Scene(self.connection, d))
+        self.sources, self.sources_by_name = {}, {}
+        for d in sources["result"]:
+            self._add(self.sources, self.sources_by_name, d["sourceId"], Source(self.connection, d))
+        self.audio_sources, self.audio_sources_by_name = {}, {}
+        for d in audio_sources["result"]:
+            self._add(self.audio_sources, self.audio_sources_by_name, d["sourceId"], AudioSource(self.connection, d))
+        self.active_scene_id = active_scene["result"]["id"] if active_scene["result"] else None
+
+    @property
+    def active_scene(self):
+        return self.scenes.get(self.active_scene_id)
+
+    async def _apply_events(self, subscription: Subscription, handler) -> None:
+        dropped = subscription.dropped
+        async for data in subscription:
+            if subscription.dropped != dropped:
+                # fell behind and lost events, only a full reload can tell what they were
+                dropped = subscription.dropped
+                self._schedule_reload()
+            try:
+                await handler(data)
+            except Exception:
+                self._schedule_reload()
+
+    def _schedule_reload(self) -> None:
+        if self._reload_task == None or self._reload_task.done():
+            self._reload_task = asyncio.ensure_future(self._reload_quietly())
+
+    async def _reload_quietly(self) -> None:
+        try:
+            await self.reload()
+        except RequestFailed:
+            # most likely the connection is gone, the reconnect callback reloads it again
+            pass
+
+    async def _fetch_audio_sources(self) -> None:
+        # looks up the AudioSource models of added sources in batches, away from the event handlers
+        while self.pending_audio:
+            source_ids, self.pending_audio = list(self.pending_audio), set()
+            calls = [("getSource", "AudioService", [source_id]) for source_id in source_ids]
+            results = await self.connection.send_batch(calls, return_exceptions=True)
+            for source_id, result in zip(source_ids, results):
+                if isinstance(result, BaseException):
+                    self._schedule_reload()
+                elif result["result"] and source_id in self.sources:
+                    self._add(self.audio_sources, self.audio_sources_by_name, source_id,
+                              AudioSource(self.connection, result["result"]))
+
+    @staticmethod
+    def _add(by_id: dict, by_name: dict, key: str, obj) -> None:
+        StateMirror._remove(by_id, by_name, key)
+        by_id[key] = obj
+        by_name.setdefault(obj.name, []).append(obj)
+
+    @staticmethod
+    def _remove(by_id: dict, by_name: dict, key: str) -> None:
+        obj = by_id.pop(key, None)
+        if obj == None:
+            return
+        same_name = by_name.get(obj.name, [])
+        if obj in same_name:
+            same_name.remove(obj)
+        if not same_name:
+            by_name.pop(obj.name, None)
+
+    async def on_scene_added(self, data: dict) -> None:
+        # take the old entry out of the name index before the shared wrapper gets the new payload
+        self._remove(self.scenes, self.scenes_by_name, data["id"])
+        self._add(self.scenes, self.scenes_by_name, data["id"], Scene(self.connection, data))
+
+    async def on_scene_removed(self, data: dict) -> None:
+        self._remove(self.scenes, self.scenes_by_name, data["id"])
+
+    async def on_scene_switched(self, data: dict) -> None:
+        if data["id"] not in self.scenes:
+            await self.on_scene_added(data)
+        self.active_scene_id = data["id"]
+
+    async def on_source_added(self, data: dict) -> None:
+        self._remove(self.sources, self.sources_by_name, data["sourceId"])
+        self._add(self.sources, self.sources_by_name, data["sourceId"], Source(self.connection, data))
+        if data.get("audio"):
+            self._queue_audio_source(data["sourceId"])
+
+    def _queue_audio_source(self, source_id: str) -> None:
+        self.pending_audio.add(source_id)
+        if self._audio_task == None or self._audio_task.done():
+            self._audio_task = asyncio.ensure_future(self._fetch_audio_sources())
+
+    async def on_source_removed(self, data: dict) -> None:
+        self.pending_audio.discard(data["sourceId"])
+        self._remove(self.sources, self.sources_by_name, data["sourceId"])
+        self._remove(self.audio_sources, self.audio_sources_by_name, data["sourceId"])
+
+    async def on_source_updated(self, data: dict) -> None:
+        self._remove(self.sources, self.sources_by_name, data["sourceId"])
+        self._add(self.sources, self.sources_by_name, data["sourceId"], Source(self.connection, data))
+        audio_source = self.audio_sources.get(data["sourceId"])
+        if "audio" in data and not data["audio"]:
+            # no longer an audio source (e.g. a browser source taken off OBS audio control)
+            self.pending_audio.discard(data["sourceId"])
+            self._remove(self.audio_sources, self.audio_sources_by_name, data["sourceId"])
+        elif audio_source == None:
+            if data.get("audio"):
+                # turned into one after it was added
+                self._queue_audio_source(data["sourceId"])
+        else:
+            # update in place so anyone holding on to the object sees the change too
+            self._remove(self.audio_sources, self.audio_sources_by_name, data["sourceId"])
+            audio_source.name = data["name"]
+            audio_source.muted = data["muted"]
+            self._add(self.audio_sources, self.audio_sources_by_name, data["sourceId"], audio_source)
 
-    async def close(self) -> None:
+
+class PerformanceSampler:
+    """Polls PerformanceService in the background and keeps a fixed-size history of it.
+
+    Every field lives in its own array-backed ring buffer, so reading the latest value,
+    windowed averages or percentiles never touches SLOBS and the memory used stays the
+    same no matter how long it runs. Fields SLOBS doesn't report are stored as NaN and
+    left out of the statistics.
+    """
+
+    fields = ("CPU", "frameRate", "numberDroppedFrames", "percentageDroppedFrames",
+              "numberSkippedFrames", "percentageSkippedFrames", "bandwidth")
+
+    def __init__(self, connection: SlobsConnection, interval: float=1.0, capacity: int=3600):
+        self.connection = connection
+        self.interval = interval
+        self.capacity = capacity
+        # SLOBS key -> snake_case name, worked out once instead of on every sample
+        self.names = {k: performance_key(k) for k in self.fields}
+        self.timestamps = array("d", [0.0]) * capacity
+        self.history = {name: array("d", [math.nan]) * capacity for name in self.names.values()}
+        self.index = 0
+        self.count = 0
+        self.errors = 0
+        # why the last sample failed, None while they're going through
+        self.last_error = None
+        # the most recent model as get_performance_state returns it (all keys, original types),
+        # and time.monotonic() of when it came in
+        self.model = None
+        self.updated = None
         self.running = False
+        self.task = None
 
-    async def main_loop(self) -> NoReturn:
+    async def start(self) -> None:
+        # only counts as running once the first sample made it, a failure is raised as is
+        await self.sample()
+        self.running = True
+        self.task = asyncio.ensure_future(self._poll())
+
+    async def stop(self) -> None:
+        self.running = False
+        if self.task != None:
+            self.task.cancel()
+            self.task = None
+
+    async def sample(self) -> None:
+        response = await self.connection.send_and_wait_response("getModel", "PerformanceService", priority=BACKGROUND)
+        self.record(response["result"], time.time())
+        self.updated = time.monotonic()
+        self.last_error = None
+
+    def record(self, model: dict, timestamp: float) -> None:
+        # convert everything first so a bad value can't leave a half written sample behind
+        values = [(self.history[name], model.get(key)) for key, name in self.names.items()]
+        values = [(history, float(value) if value != None else math.nan) for history, value in values]
+        i = self.index
+        self.timestamps[i] = timestamp
+        for history, value in values:
+            history[i] = value
+        self.model = {performance_key(k): v for k, v in model.items()}
+        self.index = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    async def _poll(self) -> None:
         while self.running:
-            await self.recieve_if_available()
-            # Send all messages in outgoing queue
-            while not len(self.outgoing_queue) == 0:
-                win32file.WriteFile(self.pipe_handle, self.outgoing_queue.popleft())
-            await asyncio.sleep(0.1)
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sample()
+            except Exception as e:
+                # a bad sample (lost connection, malformed model) mustn't end the polling
+                self.errors += 1
+                self.last_error = e
+
+    def is_fresh(self) -> bool:
+        # whether model can stand in for a live read: the last sample worked and isn't overdue
+        return (self.running and self.last_error == None and self.updated != None
+                and time.monotonic() - self.updated <= 2 * self.interval)
+
+    def latest(self) -> Union[dict, None]:
+        if self.count == 0:
+            return None
+        i = (self.index - 1) % self.capacity
+        return {name: values[i] for name, values in self.history.items()}
+
+    def values(self, field: str, seconds: float=None) -> list:
+        """The recorded values of `field` (snake_case) from oldest to newest, optionally only the last `seconds`"""
+        values = self.history[field]
+        cutoff = time.time() - seconds if seconds != None else None
+        result = []
+        for n in range(1, self.count + 1):
+            i = (self.index - n) % self.capacity
+            if cutoff != None and self.timestamps[i] < cutoff:
+                break
+            if not math.isnan(values[i]):
+                result.append(values[i])
+        result.reverse()
+        return result
+
+    def average(self, field: str, seconds: float=None) -> Union[float, None]:
+        values = self.values(field, seconds)
+        return sum(values) / len(values) if values else None
+
+    def percentile(self, field: str, p: float, seconds: float=None) -> Union[float, None]:
+        values = sorted(self.values(field, seconds))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+ROLLED_BACK = "rolled back"
+
+
+class TransactionStep:
+    """One change in a Transaction. After the transaction has run, `status` says how it went
+    and `result`/`error` hold the response or what went wrong."""
+
+    def __init__(self, method: str, resource: str, args: list=None, after: list=(), undo=None, snapshot: tuple=None,
+                 verify=None, on_done=None, on_undone=None):
+        self.method = method
+        self.resource = resource
+        self.args = args
+        # steps that have to succeed before this one is sent
+        self.after = list(after)
+        self.level = max((step.level + 1 for step in self.after), default=0)
+        # the (method, resource, args) call that reverts this step, or a function that makes it
+        # from the result of `snapshot`, a read sent before anything in the transaction is changed
+        self.undo = undo
+        self.snapshot = snapshot
+        # returns False if a response still means the step didn't do anything
+        self.verify = verify
+        # keep the wrappers in line with what happened
+        self.on_done = on_done
+        self.on_undone = on_undone
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.rollback_error = None
+
+    def __repr__(self) -> str:
+        return f"<TransactionStep {self.method} {self.resource} {self.status}>"
+
+
+class Transaction:
+    """A set of changes applied together, e.g. everything a "go live" button does.
+
+    Steps that don't depend on each other are sent in a single write, so they take one
+    round-trip between them; steps with `after` wait for the ones they depend on (and are
+    skipped if those fail). If anything fails and `rollback` is on, every step that went
+    through is reverted, using the state the wrappers had before (muted, fader) or what
+    SLOBS reported just before the change (active scene, settings).
+
+        async with slobs.transaction() as tx:
+            switch = tx.set_active(game_scene)
+            tx.set_muted(mic, False)
+            tx.set_deflection(music, 0.2)
+            tx.update_settings(title, {"text": "Live!"}, after=[switch])
+        print(tx.steps)
+
+    Settings keys that update_settings adds (rather than changes) aren't removed again by a
+    rollback. A step that couldn't be (fully) reverted keeps its status and has `rollback_error`
+    set, which is filled in as soon as that's known: when the state to revert to couldn't be
+    read, or the step adds settings keys.
+
+    Like Batch, the first failure is raised once everything is done (and rolled back),
+    unless return_exceptions is set; the steps always have the full story.
+    """
+
+    def __init__(self, slobs, rollback: bool=True, return_exceptions: bool=False, priority: int=INTERACTIVE,
+                 timeout: float=None):
+        self.slobs = slobs
+        self.rollback = rollback
+        self.return_exceptions = return_exceptions
+        self.priority = priority
+        self.timeout = timeout
+        self.steps = []
+
+    def add(self, step: TransactionStep) -> TransactionStep:
+        for dependency in step.after:
+            if dependency not in self.steps:
+                raise ValueError("steps can only depend on steps added to the same transaction before them")
+        if callable(step.undo) and step.snapshot == None:
+            raise ValueError("an undo function needs a snapshot to make the undo call from")
+        self.steps.append(step)
+        return step
+
+    def call(self, method: str, resource: str, args: list=None, undo=None, after: list=(),
+             snapshot: tuple=None) -> TransactionStep:
+        return self.add(TransactionStep(method, resource, args, after, undo, snapshot))
+
+    def set_active(self, scene, after: list=()) -> TransactionStep:
+        state = self.slobs.state
+        if state != None and state.active_scene_id != None:
+            undo, snapshot = ("makeSceneActive", "ScenesService", [state.active_scene_id]), None
+        else:
+            undo = lambda active: ("makeSceneActive", "ScenesService", [active["id"]]) if active else None
+            snapshot = ("activeScene", "ScenesService", None)
+        return self.add(TransactionStep("makeSceneActive", "ScenesService", [scene.id], after, undo, snapshot,
+                                        verify=lambda result: result != False))
+
+    def set_muted(self, audio_source, muted: bool, after: list=()) -> TransactionStep:
+        previous = audio_source.muted
+        return self.add(TransactionStep(
+            "setMuted", audio_source.resource_id, [muted], after, ("setMuted", audio_source.resource_id, [previous]),
+            on_done=lambda: setattr(audio_source, "muted", muted),
+            on_undone=lambda: setattr(audio_source, "muted", previous)))
+
+    def set_deflection(self, audio_source, deflection: float, after: list=()) -> TransactionStep:
+        previous = audio_source.fader["deflection"]
+        return self.add(TransactionStep(
+            "setDeflection", audio_source.resource_id, [deflection], after,
+            ("setDeflection", audio_source.resource_id, [previous]),
+            on_done=lambda: audio_source.fader.__setitem__("deflection", deflection),
+            on_undone=lambda: audio_source.fader.__setitem__("deflection", previous)))
+
+    def update_settings(self, source, settings: dict, after: list=()) -> TransactionStep:
+        step = TransactionStep("updateSettings", source.resource_id, [settings], after, None,
+                               ("getSettings", source.resource_id, None))
+        def undo(old):
+            # only the keys being changed are put back, and only if they were there before,
+            # keys the step adds stay in the settings after a rollback
+            added = [k for k in settings if k not in old]
+            if added:
+                step.rollback_error = RequestFailed(f"settings added by the step can't be rolled back: {', '.join(added)}")
+            restore = {k: old[k] for k in settings if k in old}
+            return ("updateSettings", source.resource_id, [restore]) if restore else None
+        step.undo = undo
+        return self.add(step)
+
+    async def run(self) -> list:
+        connection = self.slobs.connection
+        levels = {}
+        for step in self.steps:
+            levels.setdefault(step.level, []).append(step)
+        # the reads undo information comes from go out first, in the same write as the first changes
+        snapshots = [step for step in self.steps if step.snapshot != None] if self.rollback else []
+        failed = False
+        for level in sorted(levels):
+            ready = []
+            for step in levels[level]:
+                if failed and self.rollback:
+                    # it's all going to be undone anyway
+                    step.status = SKIPPED
+                elif any(dependency.status != DONE for dependency in step.after):
+                    step.status = SKIPPED
+                    step.error = RequestFailed("a step it depends on didn't go through")
+                else:
+                    ready.append(step)
+            if not ready:
+                continue
+            calls = [step.snapshot for step in snapshots] + [(s.method, s.resource, s.args) for s in ready]
+            results = await connection.send_batch(calls, return_exceptions=True, priority=self.priority,
+                                                  timeout=self.timeout)
+            for step, result in zip(snapshots, results):
+                if isinstance(result, BaseException):
+                    # without the old state there's nothing to roll back to, say so on the step
+                    step.undo, step.rollback_error = None, result
+                else:
+                    step.undo = step.undo(result["result"])
+                    if step.undo == None and step.rollback_error == None:
+                        step.rollback_error = RequestFailed("nothing to roll back to")
+            for step, result in zip(ready, results[len(snapshots):]):
+                if isinstance(result, BaseException):
+                    step.status, step.error = FAILED, result
+                elif step.verify != None and not step.verify(result["result"]):
+                    step.status, step.error = FAILED, RequestFailed(f"{step.method} on {step.resource} didn't go through")
+                else:
+                    step.status, step.result = DONE, result["result"]
+                    if step.on_done != None:
+                        step.on_done()
+                failed = failed or step.status == FAILED
+            snapshots = []
+        if failed and self.rollback:
+            await self._rollback()
+        if not self.return_exceptions:
+            for step in self.steps:
+                if step.status == FAILED:
+                    raise step.error
+        return self.steps
+
+    async def _rollback(self) -> None:
+        # undo in the opposite order, everything of one level in one write
+        done = [step for step in self.steps if step.status == DONE and step.undo != None and not callable(step.undo)]
+        for level in sorted({step.level for step in done}, reverse=True):
+            steps = [step for step in done if step.level == level]
+            results = await self.slobs.connection.send_batch([step.undo for step in steps], return_exceptions=True,
+                                                             priority=self.priority, timeout=self.timeout)
+            for step, result in zip(steps, results):
+                if isinstance(result, BaseException):
+                    step.rollback_error = result
+                elif step.rollback_error == None:
+                    step.status = ROLLED_BACK
+                    if step.on_undone != None:
+                        step.on_undone()
+
+    async def __aenter__(self) -> "Transaction":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type == None:
+            await self.run()
 
 
 class Slobs:
 
-    def __init__(self):
-        self.connection = SlobsConnection()
+    def __init__(self, transport: Transport=None, metrics: MetricsExporter=None, scheduler: RequestScheduler=None,
+                 reconnect: ReconnectPolicy=None, timeout: float=None):
+        self.connection = SlobsConnection(transport, metrics, scheduler, reconnect, timeout)
+        # filled in by enable_state_cache, answers the getters below from memory when set
+        self.state = None
+        self.performance_sampler = None
         self.subscriptions = {}
         self.on_ready_func = None
+        self.on_error_func = None
 
     async def create_scene(self, name: str):
         response = await self.connection.send_and_wait_response("createScene", "ScenesService")
         return Scene(self.connection, response["result"])
     
+    async def enable_state_cache(self) -> StateMirror:
+        if self.state == None:
+            state = StateMirror(self.connection)
+            await state.start()
+            self.state = state
+        return self.state
+
+    async def disable_state_cache(self) -> None:
+        if self.state != None:
+            state, self.state = self.state, None
+            await state.stop()
+
     async def get_scenes(self, key=None) -> list:
-        response = await self.connection.send_and_wait_response("getScenes", "ScenesService")
-        scenes = [Scene(self.connection, d) for d in response["result"]]
+        if self.state != None:
+            scenes = list(self.state.scenes.values())
+        else:
+            response = await self.connection.read("getScenes", "ScenesService")
+            scenes = [Scene(self.connection, d) for d in response["result"]]
         if key:
             return [s for s in scenes if key(s)]
         else:
             return scenes
 
     async def get_scene(self, key=None):
+        if self.state != None:
+            return next((s for s in self.state.scenes.values() if not key or key(s)), None)
         # probably could have just taken the first element from a get_scenes search with
         # minimal performance impact but oh well
-        response = await self.connection.send_and_wait_response("getScenes", "ScenesService")
+        response = await self.connection.read("getScenes", "ScenesService")
         if key:
             for d in response["result"]:
                 if key(obj := Scene(self.connection, d)):
                     return obj
             return None
         else:
-            return Scene(self.connection, response[0])
+            return Scene(self.connection, response["result"][0]) if response["result"] else None
+
+    async def get_scene_by_name(self, name: str):
+        if self.state != None:
+            return next(iter(self.state.scenes_by_name.get(name, ())), None)
+        return await self.get_scene(key=(lambda s: s.name == name))
 
     async def get_active_scene(self):
-        response = await self.connection.send_and_wait_response("activeScene", "ScenesService")
+        if self.state != None:
+            return self.state.active_scene
+        response = await self.connection.read("activeScene", "ScenesService")
         return Scene(self.connection, response["result"])
 
     async def create_scene_collection(self, name: str):
         promise = await self.connection.send_and_wait_promise("create", "SceneCollectionsService", [{"name": name}])
-        if not promise.check_rejected():
-            return SceneCollection(self.connection, promise.response)
+        if not await promise.check_rejected():
+            return SceneCollection(self.connection, promise.response["result"]["data"])
         else:
             raise RequestFailed("could not create new scene collection")
 
     async def get_scene_collections(self) -> list:
-        response = await self.connection.send_and_wait_response("collections", "SceneCollectionsService")
+        response = await self.connection.read("collections", "SceneCollectionsService")
         return [SceneCollection(self.connection, d) for d in response["result"]]
 
     async def get_audio_sources(self, key=None) -> list:
-        response = await self.connection.send_and_wait_response("getSources", "AudioService")
-        sources = [AudioSource(self.connection, d) for d in response["result"]]
+        if self.state != None:
+            sources = list(self.state.audio_sources.values())
+        else:
+            response = await self.connection.read("getSources", "AudioService")
+            sources = [AudioSource(self.connection, d) for d in response["result"]]
         if key:
             return [s for s in sources if key(s)]
         else:
             return sources
 
     async def get_audio_source(self, key=None):
+        if self.state != None:
+            return next((s for s in self.state.audio_sources.values() if not key or key(s)), None)
         # see Slobs.get_scene
-        response = await self.connection.send_and_wait_response("getSources", "AudioService")
+        response = await self.connection.read("getSources", "AudioService")
         if key:
             for d in response["result"]:
                 if key(obj := AudioSource(self.connection, d)):
                     return obj
             return None
         else:
-            return AudioSource(self.connection, response[0])
+            return AudioSource(self.connection, response["result"][0]) if response["result"] else None
+
+    async def get_audio_source_by_name(self, name: str):
+        if self.state != None:
+            return next(iter(self.state.audio_sources_by_name.get(name, ())), None)
+        return await self.get_audio_source(key=(lambda s: s.name == name))
+
+    async def set_muted_many(self, audio_sources: list, muted: bool) -> None:
+        calls = [("setMuted", source.resource_id, [muted]) for source in audio_sources]
+        results = await self.connection.send_batch(calls, return_exceptions=True, priority=INTERACTIVE)
+        for source, result in zip(audio_sources, results):
+            if not isinstance(result, BaseException):
+                source.muted = muted
+        self._raise_first_failure(results)
+
+    async def set_deflection_many(self, audio_sources: list, deflection: float) -> None:
+        calls = [("setDeflection", source.resource_id, [deflection]) for source in audio_sources]
+        results = await self.connection.send_batch(calls, return_exceptions=True, priority=INTERACTIVE)
+        for source, result in zip(audio_sources, results):
+            if not isinstance(result, BaseException):
+                source.fader["deflection"] = deflection
+        self._raise_first_failure(results)
+
+    def transaction(self, rollback: bool=True, return_exceptions: bool=False, priority: int=INTERACTIVE,
+                    timeout: float=None) -> Transaction:
+        return Transaction(self, rollback, return_exceptions, priority, timeout)
+
+    async def update_settings_many(self, settings: dict) -> None:
+        # settings maps each Source to the settings to update it with
+        calls = [("updateSettings", source.resource_id, [s]) for source, s in settings.items()]
+        self._raise_first_failure(await self.connection.send_batch(calls, return_exceptions=True))
+
+    @staticmethod
+    def _raise_first_failure(results: list) -> None:
+        # the whole batch always gets to finish, then the first error (if any) is raised
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
     async def get_performance_state(self) -> dict:
-        # TODO: Make more clean? efficient?
-        response = await self.connection.send_and_wait_response("getModel", "PerformanceService")
-        response["result"]["cpu"] = response["result"].pop("CPU")
-        return {to_lowercase_with_underscores(k):v for k, v in response["result"].items()}
+        if self.performance_sampler != None and self.performance_sampler.is_fresh():
+            return dict(self.performance_sampler.model)
+        # no sampler, or it's behind or failing: ask SLOBS, which also surfaces an outage
+        response = await self.connection.read("getModel", "PerformanceService", priority=BACKGROUND)
+        return {performance_key(k):v for k, v in response["result"].items()}
+
+    async def start_performance_sampler(self, interval: float=1.0, capacity: int=3600) -> "PerformanceSampler":
+        # once this is running get_performance_state answers from the sampler's latest sample
+        if self.performance_sampler == None or not self.performance_sampler.running:
+            sampler = PerformanceSampler(self.connection, interval, capacity)
+            await sampler.start()
+            self.performance_sampler = sampler
+        return self.performance_sampler
+
+    async def stop_performance_sampler(self) -> None:
+        if self.performance_sampler != None:
+            await self.performance_sampler.stop()
 
     async def get_source_types(self) -> list:
-        response = await self.connection.send_and_wait_response("getAvailableSourcesTypesList", "SourcesService")
+        response = await self.connection.read("getAvailableSourcesTypesList", "SourcesService")
         return response["result"]
 
     async def create_source(self, name: str, source_type: str, channel: int=None, is_temporary=False):
@@ -229,11 +1949,15 @@ class Slobs:
         return Source(self.connection, response["result"])
 
     async def get_sources(self) -> list:
-        response = await self.connection.send_and_wait_response("getSources", "SourcesService")
+        if self.state != None:
+            return list(self.state.sources.values())
+        response = await self.connection.read("getSources", "SourcesService")
         return [Source(self.connection, d) for d in response["result"]]
 
     async def get_sources_by_name(self, name: str) -> list:
-        response = await self.connection.send_and_wait_response("getSourcesByName", "SourcesService", [name])
+        if self.state != None:
+            return list(self.state.sources_by_name.get(name, ()))
+        response = await self.connection.read("getSourcesByName", "SourcesService", [name])
         return [Source(self.connection, d) for d in response["result"]]
     
     async def show_add_source(self, source_type: str=None) -> None:
@@ -242,34 +1966,58 @@ class Slobs:
         else:
             await self.connection.send_and_wait_response("showShowcase", "SourcesService")
 
+    def prepare_save_replay(self) -> PreparedCall:
+        return self.connection.prepare("saveReplay", "StreamingService", priority=INTERACTIVE)
+
     async def save_replay(self) -> None:
-        await self.connection.send_and_wait_response("saveReplay", "StreamingService")
+        await self.connection.send_and_wait_response("saveReplay", "StreamingService", priority=INTERACTIVE)
 
     async def start_replay_buffer(self) -> None:
-        await self.connection.send_and_wait_response("startReplayBuffer", "StreamingService")
+        await self.connection.send_and_wait_response("startReplayBuffer", "StreamingService", priority=INTERACTIVE)
     
     async def stop_replay_buffer(self) -> None:
-        await self.connection.send_and_wait_response("stopReplayBuffer", "StreamingService")
+        await self.connection.send_and_wait_response("stopReplayBuffer", "StreamingService", priority=INTERACTIVE)
 
     async def toggle_recording(self) -> None:
-        await self.connection.send_and_wait_response("toggleRecording", "StreamingService")
+        await self.connection.send_and_wait_response("toggleRecording", "StreamingService", priority=INTERACTIVE)
         
     async def toggle_streaming(self) -> None:
-        await self.connection.send_and_wait_response("toggleStreaming", "StreamingService")
+        await self.connection.send_and_wait_response("toggleStreaming", "StreamingService", priority=INTERACTIVE)
 
     async def disable_studio_mode(self) -> None:
-        await self.connection.send_and_wait_response("disableStudioMode", "TransitionsService")
+        await self.connection.send_and_wait_response("disableStudioMode", "TransitionsService", priority=INTERACTIVE)
 
     async def enable_studio_mode(self) -> None:
-        await self.connection.send_and_wait_response("enableStudioMode", "TransitionsService")
+        await self.connection.send_and_wait_response("enableStudioMode", "TransitionsService", priority=INTERACTIVE)
         
     async def execute_studio_mode_transition(self) -> None:
-        await self.connection.send_and_wait_response("executeStudioModeTransition", "TransitionsService")
-
-    # TODO: Decorator to create a subscription
-    def subscription(self, f):
-        self.subscriptions[f.__name__] = f
-        return f
+        await self.connection.send_and_wait_response("executeStudioModeTransition", "TransitionsService", priority=INTERACTIVE)
+
+    async def subscribe(self, resource: str, event: str, maxsize: int=256, overflow: str=DROP_OLDEST) -> Subscription:
+        return await self.connection.subscribe(resource, event, maxsize, overflow)
+
+    def subscription(self, resource: str, event: str, maxsize: int=256, overflow: str=DROP_OLDEST):
+        # Decorator to call a coroutine with the data of every `resource`.`event` event,
+        # e.g. @slobs.subscription("ScenesService", "sceneSwitched")
+        def decorator(f):
+            self.subscriptions[f.__name__] = (resource, event, maxsize, overflow, f)
+            return f
+        return decorator
+
+    async def _run_subscription(self, resource: str, event: str, maxsize: int, overflow: str, f) -> None:
+        # each handler gets its own queue, so a slow one only falls behind on its own events
+        async for data in await self.subscribe(resource, event, maxsize, overflow):
+            try:
+                await f(data)
+            except Exception as e:
+                # one bad event shouldn't leave the rest piling up with nobody reading them
+                self._report(f.__name__, e)
+
+    def _report(self, name: str, exception: Exception) -> None:
+        if self.on_error_func != None:
+            self.on_error_func(name, exception)
+        else:
+            print(f"Error: subscription handler {name} failed: {exception}")
 
     def on_tick(self, f):
         self.connection.on_tick_func = f
@@ -279,41 +2027,112 @@ class Slobs:
         self.on_ready_func = f
         return f
 
+    def on_error(self, f):
+        # called with (handler name, exception) when a subscription handler fails, the default just prints it
+        self.on_error_func = f
+        return f
+
+    async def start(self) -> None:
+        # connect and start the connection loop and subscription handlers in the background
+        await self.connection.connect()
+        asyncio.ensure_future(self.connection.main_loop())
+        for resource, event, maxsize, overflow, f in self.subscriptions.values():
+            asyncio.ensure_future(self._run_subscription(resource, event, maxsize, overflow, f))
+
     def run(self):
         loop = asyncio.get_event_loop()
-        loop.create_task(self.connection.main_loop())
+        try:
+            loop.run_until_complete(self.start())
+        except ConnectionLost:
+            print("Error: Streamlabs OBS must be open for this script to work.")
+            return
         if self.on_ready_func != None:
             loop.create_task(self.on_ready_func())
         loop.run_forever()
 
 
-class SceneCollection:
+class _Field:
+    """An attribute that reads (and writes) one key of a wrapper's raw payload"""
 
-    def __init__(self, connection, data):
-        self.connection = connection
-        self.id = data["id"]
-        self.name = data["name"]
-        self.modified = data["modified"]
-        self.auto = data["auto"]
-        self.operating_system = data["operatingSystem"]
-        self.deleted = data["deleted"]
-        self.needs_rename = data["needsRename"]
-        try:
-            self.server_id = data["serverId"]
-            print("it worked i guess")
-        except KeyError:
-            print("it did not work")
+    __slots__ = ("key",)
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj._data.get(self.key)
+
+    def __set__(self, obj, value) -> None:
+        obj._data[self.key] = value
+
+
+class _ObjectRef(weakref.ref):
+
+    __slots__ = ("key",)
+
+
+class SlobsObject:
+    """Base class for the wrappers around SLOBS models.
+
+    The payload SLOBS sent is kept as is and attributes are only looked up in it when
+    they're read. With SlobsConnection.enable_identity_map there's also only one live
+    wrapper per resource and connection: constructing another one for the same resource
+    hands back the existing object, refreshed with the new payload.
+    """
+
+    __slots__ = ("connection", "_data", "__weakref__")
+    identity_key = "resourceId"
+
+    def __new__(cls, connection: SlobsConnection, data: dict):
+        # everything happens here rather than in __init__, it's the hot path for big payloads
+        objects = connection.objects
+        if objects is None:
+            obj = object.__new__(cls)
+            obj.connection = connection
+            obj._data = data
+            return obj
+        key = (cls, cls.identity(data))
+        ref = objects.get(key)
+        obj = ref() if ref is not None else None
+        if obj is None:
+            obj = object.__new__(cls)
+            ref = objects[key] = _ObjectRef(obj, connection._forget_object)
+            ref.key = key
+        obj.connection = connection
+        obj._data = data
+        return obj
+
+    @classmethod
+    def identity(cls, data: dict):
+        return data[cls.identity_key]
+
+
+class SceneCollection(SlobsObject):
+
+    __slots__ = ()
+    identity_key = "id"
+
+    id = _Field("id")
+    name = _Field("name")
+    modified = _Field("modified")
+    auto = _Field("auto")
+    operating_system = _Field("operatingSystem")
+    deleted = _Field("deleted")
+    needs_rename = _Field("needsRename")
+    server_id = _Field("serverId")
 
     async def delete(self) -> None:
         r_id = await self.connection.send_request("delete", "SceneCollectionsService", args=[self.id])
-        await self.connection.wait_for_promise(r_id)
+        await (await self.connection.wait_for_promise(r_id)).get()
     
     async def set_active(self) -> None:
         r_id = await self.connection.send_request("load", "SceneCollectionsService", args=[self.id])
-        await self.connection.wait_for_promise(r_id)
+        await (await self.connection.wait_for_promise(r_id)).get()
 
     async def rename(self, new_name: str) -> bool:
-        r_id = await self.connection.send_request("rename", "SceneCollectionsService", args=[self.id])
+        r_id = await self.connection.send_request("rename", "SceneCollectionsService", args=[self.id, new_name])
         promise = await self.connection.wait_for_promise(r_id)
         # only change the name if the name change went through
         # also return the success
@@ -323,24 +2142,27 @@ class SceneCollection:
         return False
 
 
-class Scene:
+class Scene(SlobsObject):
 
-    def __init__(self, connection, data):
-        self.connection = connection
-        self.resource_id = data["resourceId"]
-        self.id = data["id"]
-        self.name = data["name"]
-        # self.nodes = [Node(connection, d) for d in data["nodes"]] # probably gonna remove
+    __slots__ = ()
+
+    resource_id = _Field("resourceId")
+    id = _Field("id")
+    name = _Field("name")
 
     async def set_active(self) -> bool:
-        response = await self.connection.send_and_wait_response("makeSceneActive", "ScenesService", [self.id])
+        response = await self.connection.send_and_wait_response("makeSceneActive", "ScenesService", [self.id], INTERACTIVE)
         return response["result"]
+
+    def prepare_set_active(self) -> PreparedCall:
+        return self.connection.prepare("makeSceneActive", "ScenesService", [self.id], INTERACTIVE)
     
     async def delete(self) -> None:
         await self.connection.send_and_wait_response("removeScene", "ScenesService", [self.id])
 
-    async def get_audio_sources(self):
-        await self.connection.send_and_wait_response("getSourcesForScene", "AudioService", [self.id])
+    async def get_audio_sources(self) -> list:
+        response = await self.connection.read("getSourcesForScene", "AudioService", [self.id])
+        return [AudioSource(self.connection, d) for d in response["result"]]
 
     async def get_audio_source(self, name: str):
         # see Slobs.get_scene
@@ -348,22 +2170,22 @@ class Scene:
         return next((s for s in sources if s.name == name), None)
 
 
-class Source:
+class Source(SlobsObject):
 
-    def __init__(self, connection: SlobsConnection, data: dict):
-        self.connection = connection
-        self.resource_id = data["resourceId"]
-        self.source_id = data["sourceId"]
-        self.id = data["id"]
-        self.name = data["name"]
-        self.type = data["type"]
-        self.audio = data["audio"]
-        self.video = data["video"]
-        self._async = data["async"]
-        self.muted = data["muted"]
-        self.width = data["width"]
-        self.height = data["height"]
-        self.do_not_duplicate = data["doNotDuplicate"]
+    __slots__ = ()
+
+    resource_id = _Field("resourceId")
+    source_id = _Field("sourceId")
+    id = _Field("id")
+    name = _Field("name")
+    type = _Field("type")
+    audio = _Field("audio")
+    video = _Field("video")
+    _async = _Field("async")
+    muted = _Field("muted")
+    width = _Field("width")
+    height = _Field("height")
+    do_not_duplicate = _Field("doNotDuplicate")
 
     async def delete(self) -> None:
         await self.connection.send_and_wait_response("removeSource", "SourcesService", [self.id])
@@ -380,10 +2202,10 @@ class Source:
         pass
 
     async def get_settings(self) -> dict:
-        return (await self.connection.send_and_wait_response("getSettings", self.resource_id))["result"]
+        return (await self.connection.read("getSettings", self.resource_id))["result"]
 
     async def has_props(self) -> bool:
-        return (await self.connection.send_and_wait_response("hasProps", self.resource_id))["result"]
+        return (await self.connection.read("hasProps", self.resource_id))["result"]
 
     async def refresh(self) -> None:
         await self.connection.send_and_wait_response("refresh", self.resource_id)
@@ -398,52 +2220,959 @@ class Source:
     async def update_settings(self, settings: dict) -> None:
         await self.connection.send_and_wait_response("updateSettings", self.resource_id, [settings])
 
+    def prepare_update_settings(self, settings: dict) -> PreparedCall:
+        return self.connection.prepare("updateSettings", self.resource_id, [settings])
+
     async def show_properties(self) -> None:
         await self.connection.send_and_wait_response("showSourceProperties", "SourcesService", [self.source_id])
 
     
 
 
-class AudioSource:
+class AudioSource(SlobsObject):
 
-    def __init__(self, connection: SlobsConnection, data: dict):
-        self.connection = connection
-        self.resource_id = data["resourceId"]
-        self.name = data["name"]
-        self.source_id = data["sourceId"]
-        self.fader = data["fader"]
-        self.audio_mixers = data["audioMixers"]
-        self.monitoring_type = data["monitoringType"]
-        self.force_mono = data["forceMono"]
-        self.sync_offset = data["syncOffset"]
-        self.muted = data["muted"]
-        self.mixer_hidden = data["mixerHidden"]
+    __slots__ = ()
+
+    resource_id = _Field("resourceId")
+    name = _Field("name")
+    source_id = _Field("sourceId")
+    fader = _Field("fader")
+    audio_mixers = _Field("audioMixers")
+    monitoring_type = _Field("monitoringType")
+    force_mono = _Field("forceMono")
+    sync_offset = _Field("syncOffset")
+    muted = _Field("muted")
+    mixer_hidden = _Field("mixerHidden")
 
     async def set_deflection(self, deflection: int) -> None:
-        await self.connection.send_and_wait_response("setDeflection", self.resource_id, [deflection])
+        await self.connection.send_and_wait_response("setDeflection", self.resource_id, [deflection], INTERACTIVE)
         self.fader["deflection"] = deflection
     
     async def set_muted(self, muted: bool) -> None:
-        await self.connection.send_and_wait_response("setMuted", self.resource_id, [muted])
+        await self.connection.send_and_wait_response("setMuted", self.resource_id, [muted], INTERACTIVE)
         self.muted = muted
 
-class SceneItem:
-
-    def __init__(self, connection: SlobsConnection, data: dict):
-        self.connection = connection
-        self.id = data["id"]
-        self.locked = data["locked"]
-        self.name = data["name"]
-        self.node_id = data["nodeId"]
-        self.parent_id = data["parentId"]
-        self.recording_visible = data["recordingVisible"]
-        self.scene_id = data["sceneId"]
-        self.scene_item_id = data["sceneItemId"]
-        self.scene_node_type = data["sceneNodeType"]
-        self.source_id = data["sourceId"]
-        self.stream_visible = data["streamVisible"]
-        self.transform = data["transform"]
-        self.visible = data["visible"]
+    def prepare_set_deflection(self, deflection: float) -> PreparedCall:
+        def after(response):
+            self.fader["deflection"] = deflection
+        return self.connection.prepare("setDeflection", self.resource_id, [deflection], INTERACTIVE, after=after)
+
+    def prepare_set_muted(self, muted: bool) -> PreparedCall:
+        def after(response):
+            self.muted = muted
+        return self.connection.prepare("setMuted", self.resource_id, [muted], INTERACTIVE, after=after)
+
+class SceneItem(SlobsObject):
+
+    __slots__ = ()
+
+    id = _Field("id")
+    locked = _Field("locked")
+    name = _Field("name")
+    node_id = _Field("nodeId")
+    parent_id = _Field("parentId")
+    recording_visible = _Field("recordingVisible")
+    scene_id = _Field("sceneId")
+    scene_item_id = _Field("sceneItemId")
+    scene_node_type = _Field("sceneNodeType")
+    source_id = _Field("sourceId")
+    stream_visible = _Field("streamVisible")
+    transform = _Field("transform")
+    visible = _Field("visible")
+
+    @classmethod
+    def identity(cls, data: dict):
+        return (data["sceneId"], data["sceneItemId"])
     
     async def add_to_selection(self) -> None:
-        await self.connectionsend_and_wait_response
\ No newline at end of file
+        await self.connectionsend_and_wait_response
+
+
+class SyncProxy:
+    """Blocking view of an object that lives on a SyncSlobs event loop: its methods
+    run on the loop and wait for the result, other attributes are proxied in turn"""
+
+    __slots__ = ("_sync", "_target")
+
+    def __init__(self, sync, target):
+        self._sync = sync
+        self._target = target
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        sync = self._sync
+        if inspect.iscoroutinefunction(attr):
+            def call(*args, **kwargs):
+                return sync.wrap(sync.call(attr(*sync.unwrap(args), **sync.unwrap(kwargs))))
+        elif inspect.ismethod(attr):
+            # plain methods touch loop-owned futures and tasks too (close, cancel, invalidate...), so they
+            # run on the loop as well, and can still hand out things with coroutine methods (prepare_*)
+            def call(*args, **kwargs):
+                return sync.wrap(sync.call_soon(attr, *sync.unwrap(args), **sync.unwrap(kwargs)))
+        else:
+            # loop-owned objects (state, performance_sampler, connection, wrappers) get proxied too
+            return sync.wrap(attr)
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    def __call__(self, *args, **kwargs):
+        sync = self._sync
+        return sync.wrap(sync.call(self._target(*sync.unwrap(args), **sync.unwrap(kwargs))))
+
+    def __iter__(self):
+        # blocking iteration over anything async-iterable, e.g. a Subscription
+        if not hasattr(self._target, "__anext__"):
+            raise TypeError(f"{type(self._target).__name__} object is not iterable")
+        while True:
+            try:
+                yield self._sync.call(self._target.__anext__())
+            except StopAsyncIteration:
+                return
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SyncProxy):
+            other = other._target
+        return self._target == other
+
+    def __hash__(self) -> int:
+        return hash(self._target)
+
+    def __repr__(self) -> str:
+        return f"<SyncProxy of {self._target!r}>"
+
+
+class SyncSlobs(SyncProxy):
+    """Blocking, thread-safe front end to Slobs for code that isn't async.
+
+    The event loop runs on its own daemon thread and every call is handed over to it,
+    so any number of threads can share the one connection and have requests in flight
+    at the same time. Methods of Slobs and of the Scene/Source/AudioSource/... objects
+    they return are all available as normal blocking methods:
+
+        with pyslobs.SyncSlobs() as slobs:
+            slobs.get_scene_by_name("Game").set_active()
+    """
+
+    __slots__ = ("loop", "thread", "timeout")
+
+    def __init__(self, transport: Transport=None, metrics: MetricsExporter=None, scheduler: RequestScheduler=None,
+                 reconnect: ReconnectPolicy=None, timeout: float=None):
+        # the timeout is also the connection's default, so requests fail with RequestTimeout on their own
+        super().__init__(self, Slobs(transport, metrics, scheduler, reconnect, timeout))
+        # how long a blocking call waits before giving up (and cancelling the request), None waits forever
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="pyslobs", daemon=True)
+
+    @property
+    def slobs(self) -> Slobs:
+        return self._target
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self) -> "SyncSlobs":
+        # start the loop thread and connect, raises ConnectionLost if SLOBS isn't there
+        if not self.thread.is_alive():
+            self.thread.start()
+            try:
+                self.call(self._target.start())
+            except BaseException:
+                self.close()
+                raise
+        return self
+
+    def close(self) -> None:
+        if not self.thread.is_alive():
+            return
+        self.call(self._shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _shutdown(self) -> None:
+        await self._target.connection.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def call(self, coro, timeout: float=None):
+        """Run a coroutine on the connection's loop and block until it's done"""
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("SyncSlobs would deadlock waiting on its own loop, await the Slobs methods there instead")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        timeout = timeout if timeout != None else self.timeout
+        try:
+            return future.result(timeout)
+        except RequestTimeout:
+            raise
+        except concurrent.futures.TimeoutError:
+            # before 3.11 this isn't an asyncio.TimeoutError, so make it the same RequestTimeout as everywhere else
+            future.cancel()
+            raise RequestTimeout(f"no response from Streamlabs OBS within {timeout:.3g}s") from None
+        except BaseException:
+            # a caller that gives up (ctrl+c) shouldn't leave its request behind
+            future.cancel()
+            raise
+
+    def call_soon(self, func, *args, **kwargs):
+        """Run a plain function on the connection's loop and block until it's done"""
+        if threading.current_thread() is self.thread or not self.thread.is_alive():
+            # already on the loop, or there's no loop running yet for anything to race with
+            return func(*args, **kwargs)
+        future = concurrent.futures.Future()
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def wrap(self, value):
+        if isinstance(value, (SlobsObject, Subscription, Promise, StateMirror, PerformanceSampler, Batch, PreparedCall,
+                              Transaction, SlobsConnection)):
+            return SyncProxy(self, value)
+        if isinstance(value, list):
+            return [self.wrap(v) for v in value]
+        if isinstance(value, dict):
+            # only copied if there's something to proxy in it, plain data dicts are handed out as they are
+            wrapped = {k: self.wrap(v) for k, v in value.items()}
+            if any(w is not v for w, v in zip(wrapped.values(), value.values())):
+                return wrapped
+        return value
+
+    def unwrap(self, value):
+        if isinstance(value, SyncProxy):
+            return value._target
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.unwrap(v) for v in value)
+        if isinstance(value, dict):
+            return {self.unwrap(k): self.unwrap(v) for k, v in value.items()}
+        return value
+
+    def __enter__(self) -> "SyncSlobs":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def default_key_path() -> str:
+    if sys.platform == "win32":
+        return r"\\.\pipe\pyslobskbd"
+    return "/tmp/pyslobskbd.sock"
+
+
+class KeyListener:
+    """Receives key names from a macro keyboard script (see macro_kbd.lua), one per line.
+
+    It's the server end: on Windows a named pipe served through the proactor event loop,
+    anywhere else a Unix socket stands in for it. Keys are pushed as soon as a line comes
+    in, there's no polling involved. Iterate over it to get them:
+
+        async with pyslobs.KeyListener() as keys:
+            async for key in keys:
+                ...
+    """
+
+    def __init__(self, path: str=None, maxsize: int=256):
+        self.path = path if path != None else default_key_path()
+        self.queue = None
+        self.maxsize = maxsize
+        self.clients = set()
+        self._servers = []
+
+    async def start(self) -> "KeyListener":
+        if self._servers:
+            return self
+        self.queue = asyncio.Queue(self.maxsize)
+        if self.path.startswith("\\\\.\\pipe\\"):
+            loop = asyncio.get_running_loop()
+            if not hasattr(loop, "start_serving_pipe"):
+                raise OSError("named pipes are only available with the Windows proactor event loop")
+            def protocol_factory():
+                return asyncio.StreamReaderProtocol(asyncio.StreamReader(), self._handle_client)
+            self._servers = await loop.start_serving_pipe(protocol_factory, self.path)
+        else:
+            self._servers = [await asyncio.start_unix_server(self._handle_client, self.path)]
+        return self
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        for writer in list(self.clients):
+            writer.close()
+        if self.queue != None:
+            # wake up whoever is iterating
+            while self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # luamacros likes crlfs
+                key = line.strip().decode("ascii", "replace")
+                if key:
+                    if self.queue.full():
+                        self.queue.get_nowait()
+                    self.queue.put_nowait(key)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def get(self) -> str:
+        key = await self.queue.get()
+        if key == None:
+            self.queue.put_nowait(None)
+            raise StopAsyncIteration
+        return key
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        return await self.get()
+
+    async def __aenter__(self) -> "KeyListener":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class Action:
+    """Something a key can be bound to. resolve() looks up whatever the action works on
+    ahead of time, so a key press only has to send the request."""
+
+    async def resolve(self, slobs: Slobs) -> None:
+        pass
+
+    async def __call__(self, slobs: Slobs) -> None:
+        raise NotImplementedError
+
+
+class Call(Action):
+    """Calls a coroutine function with the Slobs instance, e.g. Call(lambda slobs: slobs.save_replay())"""
+
+    def __init__(self, f):
+        self.f = f
+
+    async def __call__(self, slobs: Slobs) -> None:
+        await self.f(slobs)
+
+
+class SwitchScene(Action):
+
+    def __init__(self, name: str):
+        self.name = name
+        self.scene = None
+        self.set_active = None
+
+    async def resolve(self, slobs: Slobs) -> None:
+        self.scene = await slobs.get_scene_by_name(self.name)
+        self.set_active = self.scene.prepare_set_active() if self.scene != None else None
+
+    async def __call__(self, slobs: Slobs) -> None:
+        if self.set_active == None:
+            await self.resolve(slobs)
+            if self.set_active == None:
+                raise LookupError(f"no scene named {self.name!r}")
+        try:
+            await self.set_active()
+        except RequestFailed:
+            # the scene may have been removed or renamed, look it up again next time
+            self.set_active = None
+            raise
+
+
+class ToggleMute(Action):
+    """Toggles an audio source by name, or the first one `key` returns True for"""
+
+    def __init__(self, name: str=None, key=None):
+        self.key = key if key != None else (lambda s: s.name == name)
+        self.description = name if name != None else "matching audio source"
+        self.source = None
+        # prepared calls for muting (True) and unmuting (False)
+        self.calls = None
+
+    async def resolve(self, slobs: Slobs) -> None:
+        self.source = await slobs.get_audio_source(key=self.key)
+        if self.source != None:
+            self.calls = {muted: self.source.prepare_set_muted(muted) for muted in (True, False)}
+        else:
+            self.calls = None
+
+    async def __call__(self, slobs: Slobs) -> None:
+        if self.calls == None:
+            await self.resolve(slobs)
+            if self.calls == None:
+                raise LookupError(f"no {self.description!r} to toggle")
+        try:
+            await self.calls[not self.source.muted]()
+        except RequestFailed:
+            self.calls = None
+            raise
+
+
+class KeyBindings:
+    """A key -> action table for a macro keyboard.
+
+    Every key press gets its own task, so a slow action never holds up the next key.
+    Presses of the same key that come in less than `debounce` seconds apart (key repeat,
+    a bouncy switch) are ignored. Actions are Action instances or coroutine functions
+    that take the Slobs instance:
+
+        bindings = pyslobs.KeyBindings(slobs, {
+            "1": pyslobs.SwitchScene("Desktop"),
+            "2": pyslobs.SwitchScene("Game"),
+            "m": pyslobs.ToggleMute("Mic/Aux"),
+        })
+        await bindings.resolve()
+        await bindings.listen(pyslobs.KeyListener())
+    """
+
+    def __init__(self, slobs: Slobs, bindings: dict=None, debounce: float=0.05):
+        self.slobs = slobs
+        self.bindings = {}
+        self.debounce = debounce
+        self.last_press = {}
+        self.tasks = set()
+        self.on_error_func = None
+        for key, action in (bindings or {}).items():
+            self.bind(key, action)
+
+    def bind(self, key: str, action) -> None:
+        self.bindings[key] = action if isinstance(action, Action) else Call(action)
+
+    def on(self, key: str):
+        # Decorator version of bind, e.g. @bindings.on("r")
+        def decorator(f):
+            self.bind(key, f)
+            return f
+        return decorator
+
+    def on_error(self, f):
+        # called with (key, exception) when an action fails, the default just prints it
+        self.on_error_func = f
+        return f
+
+    async def resolve(self) -> None:
+        # look up every action's target up front so the first press is as quick as the rest
+        results = await asyncio.gather(*(a.resolve(self.slobs) for a in self.bindings.values()), return_exceptions=True)
+        for key, result in zip(list(self.bindings), results):
+            if isinstance(result, Exception):
+                self._report(key, result)
+
+    def press(self, key: str) -> Union[asyncio.Task, None]:
+        action = self.bindings.get(key)
+        if action == None:
+            return None
+        now = time.monotonic()
+        last = self.last_press.get(key)
+        if last != None and now - last < self.debounce:
+            return None
+        self.last_press[key] = now
+        task = asyncio.ensure_future(self._run(key, action))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run(self, key: str, action: Action) -> None:
+        try:
+            await action(self.slobs)
+        except Exception as e:
+            self._report(key, e)
+
+    def _report(self, key: str, exception: Exception) -> None:
+        if self.on_error_func != None:
+            self.on_error_func(key, exception)
+        else:
+            print(f"Error: action for key {key!r} failed: {exception}")
+
+    async def listen(self, listener: KeyListener) -> None:
+        # dispatch keys from the listener until it's closed
+        async with listener:
+            async for key in listener:
+                self.press(key)
+
+
+class _MockPromise:
+
+    def __init__(self, data, rejected: bool=False):
+        self.data = data
+        self.rejected = rejected
+
+
+class MockSlobsServer:
+    """An in-process stand-in for the SLOBS JSON-RPC server.
+
+    It keeps a small fake model of scenes, sources, audio sources and scene collections
+    and answers with the same message shapes SLOBS uses (plain results, STREAM
+    subscriptions/events and PROMISE handles/fulfilments), so the library can be run,
+    load tested and benchmarked without Streamlabs. Listens on a Unix socket if `path`
+    is given, otherwise on TCP (`port=0` picks a free port).
+    """
+
+    def __init__(self, path: str=None, host: str="127.0.0.1", port: int=0, latency: float=0.0):
+        self.path = path
+        self.host = host
+        self.port = port
+        # artificial delay before each response is sent
+        self.latency = latency
+        self.server = None
+        self.clients = set()
+        self.requests_handled = 0
+
+        self.scenes = []
+        self.sources = []
+        self.collections = []
+        self.active_scene_id = None
+        self.performance = {"CPU": 12.5, "numberDroppedFrames": 0, "percentageDroppedFrames": 0.0,
+                            "bandwidth": 0.0, "frameRate": 60.0}
+        self.events = {
+            "ScenesService": {"sceneAdded", "sceneRemoved", "sceneSwitched", "itemAdded", "itemRemoved", "itemUpdated"},
+            "SourcesService": {"sourceAdded", "sourceRemoved", "sourceUpdated"},
+            "SceneCollectionsService": {"collectionAdded", "collectionRemoved", "collectionSwitched",
+                                        "collectionUpdated", "collectionWillSwitch"},
+            "StreamingService": {"streamingStatusChange", "recordingStatusChange", "replayBufferStatusChange"},
+            "TransitionsService": {"studioModeChanged"},
+        }
+        # "<resource type>.<method>" -> handler(resource, args), resource types being the part before any [...]
+        self.handlers = {
+            "ScenesService.getScenes": lambda r, a: self.scenes,
+            "ScenesService.getScene": lambda r, a: self._find(self.scenes, "id", a[0]),
+            "ScenesService.activeScene": lambda r, a: self._find(self.scenes, "id", self.active_scene_id),
+            "ScenesService.makeSceneActive": self._make_scene_active,
+            "ScenesService.createScene": lambda r, a: self.add_scene(a[0] if a else "Scene"),
+            "ScenesService.removeScene": self._remove_scene,
+            "SourcesService.getSources": lambda r, a: self.sources,
+            "SourcesService.getSource": lambda r, a: self._find(self.sources, "sourceId", a[0]),
+            "SourcesService.getSourcesByName": lambda r, a: [s for s in self.sources if s["name"] == a[0]],
+            "SourcesService.createSource": lambda r, a: self.add_source(a[0], a[1] if len(a) > 1 else "color_source"),
+            "SourcesService.addFile": lambda r, a: self.add_source(a[0].replace("\\", "/").split("/")[-1], "ffmpeg_source"),
+            "SourcesService.removeSource": self._remove_source,
+            "SourcesService.getAvailableSourcesTypesList": lambda r, a: [
+                {"description": "Image", "value": "image_source"},
+                {"description": "Color Source", "value": "color_source"},
+                {"description": "Audio Input Capture", "value": "wasapi_input_capture"},
+            ],
+            "SourcesService.showAddSource": lambda r, a: None,
+            "SourcesService.showShowcase": lambda r, a: None,
+            "SourcesService.showSourceProperties": lambda r, a: None,
+            "Source.getSettings": lambda r, a: self._source(r)["_settings"],
+            "Source.updateSettings": self._update_settings,
+            "Source.setName": self._set_name,
+            "Source.hasProps": lambda r, a: True,
+            "Source.refresh": lambda r, a: None,
+            "Source.duplicate": lambda r, a: self.add_source(self._source(r)["name"], self._source(r)["type"]),
+            "Source.getModel": lambda r, a: self._source(r),
+            "AudioService.getSources": lambda r, a: [self._audio_model(s) for s in self.sources if s["audio"]],
+            "AudioService.getSource": lambda r, a: self._audio_model(self._find(self.sources, "sourceId", a[0])),
+            "AudioService.getSourcesForScene": lambda r, a: [self._audio_model(s) for s in self.sources if s["audio"]],
+            "AudioSource.setMuted": self._set_muted,
+            "AudioSource.setDeflection": self._set_deflection,
+            "AudioSource.getModel": lambda r, a: self._audio_model(self._source(r)),
+            "PerformanceService.getModel": lambda r, a: self._performance_model(),
+            "SceneCollectionsService.collections": lambda r, a: self.collections,
+            "SceneCollectionsService.activeCollection": lambda r, a: self.collections[0] if self.collections else None,
+            "SceneCollectionsService.create": lambda r, a: _MockPromise(self.add_collection(a[0]["name"] if a else "Collection")),
+            "SceneCollectionsService.load": lambda r, a: _MockPromise(None, self._find(self.collections, "id", a[0]) == None),
+            "SceneCollectionsService.rename": self._rename_collection,
+            "SceneCollectionsService.delete": self._delete_collection,
+        }
+        for method in ("saveReplay", "startReplayBuffer", "stopReplayBuffer", "toggleRecording", "toggleStreaming"):
+            self.handlers["StreamingService." + method] = lambda r, a: None
+        for method in ("disableStudioMode", "enableStudioMode", "executeStudioModeTransition"):
+            self.handlers["TransitionsService." + method] = lambda r, a: None
+
+    def populate(self, scenes: int=2, sources: int=4, audio_sources: int=2) -> "MockSlobsServer":
+        """Fill the fake model with some generic scenes, sources and a scene collection"""
+        for i in range(scenes):
+            self.add_scene(f"Scene {i}")
+        for i in range(audio_sources):
+            self.add_source(f"Mic/Aux {i}", "wasapi_input_capture", audio=True)
+        for i in range(sources):
+            self.add_source(f"Source {i}", "image_source")
+        if not self.collections:
+            self.add_collection("Default")
+        return self
+
+    def add_scene(self, name: str) -> dict:
+        scene_id = "scene_" + uuid.uuid4().hex
+        scene = {"id": scene_id, "name": name, "resourceId": f'Scene["{scene_id}"]', "nodes": []}
+        self.scenes.append(scene)
+        if self.active_scene_id == None:
+            self.active_scene_id = scene_id
+        self.emit("ScenesService.sceneAdded", scene)
+        return scene
+
+    def add_source(self, name: str, source_type: str, audio: bool=False) -> dict:
+        prefix = source_type + "_"
+        source_id = prefix + uuid.uuid4().hex
+        source = {
+            "sourceId": source_id, "id": source_id, "name": name, "type": source_type,
+            "audio": audio, "video": not audio, "async": False, "muted": False,
+            "width": 0 if audio else 1920, "height": 0 if audio else 1080,
+            "doNotDuplicate": False, "channel": None, "resourceId": f'Source["{source_id}"]',
+            "_settings": {}, "_deflection": 1.0,
+        }
+        self.sources.append(source)
+        self.emit("SourcesService.sourceAdded", self._source_model(source))
+        return self._source_model(source)
+
+    def add_collection(self, name: str) -> dict:
+        collection = {"id": uuid.uuid4().hex, "name": name, "modified": "", "auto": False,
+                      "operatingSystem": "win32", "deleted": False, "needsRename": False, "serverId": None}
+        self.collections.append(collection)
+        return collection
+
+    def emit(self, resource_id: str, data) -> None:
+        """Push a STREAM event to every client subscribed to `resource_id` (e.g. "ScenesService.sceneSwitched")"""
+        message = None
+        for client in self.clients:
+            if resource_id in client.subscriptions:
+                if message == None:
+                    message = self._encode({"jsonrpc": "2.0", "id": None, "result": {
+                        "_type": "EVENT", "emitter": "STREAM", "resourceId": resource_id, "data": data}})
+                client.write(message)
+
+    def broadcast(self, raw: bytes) -> None:
+        """Write an already encoded message (or several) to every connected client.
+
+        `raw` may end partway through a message, anything else for those clients is held
+        back until a later broadcast finishes the line so the two don't get mixed up.
+        """
+        if not raw:
+            return
+        for client in self.clients:
+            client.writer.write(raw)
+            client.partial = not raw.endswith(b"\n")
+            if not client.partial and client.held:
+                for message in client.held:
+                    client.writer.write(message)
+                client.held = []
+
+    async def drain(self) -> None:
+        # wait until the clients have taken everything written to them so far
+        await asyncio.gather(*(client.writer.drain() for client in list(self.clients)), return_exceptions=True)
+
+    def transport(self) -> Transport:
+        """A client transport pointing at this server"""
+        if self.path != None:
+            return UnixSocketTransport(self.path)
+        return TCPTransport(self.host, self.port)
+
+    async def start(self) -> "MockSlobsServer":
+        if self.path != None:
+            self.server = await asyncio.start_unix_server(self._handle_client, self.path, limit=2 ** 24)
+        else:
+            self.server = await asyncio.start_server(self._handle_client, self.host, self.port, limit=2 ** 24)
+            self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        clients = list(self.clients)
+        for client in clients:
+            client.writer.close()
+        # let the client handlers see their connections go away
+        await asyncio.gather(*(client.task for client in clients), return_exceptions=True)
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def __aenter__(self) -> "MockSlobsServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = _MockClient(writer, asyncio.current_task())
+        self.clients.add(client)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b"":
+                    break
+                line = line.strip()
+                if line == b"":
+                    continue
+                responses = self._handle_request(client, json.loads(line))
+                if self.latency > 0:
+                    loop.call_later(self.latency, self._write_all, client, responses)
+                else:
+                    self._write_all(client, responses)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    def _write_all(self, client, responses: list) -> None:
+        if client.writer.is_closing():
+            return
+        for response in responses:
+            client.write(response)
+
+    def _handle_request(self, client, request: dict) -> list:
+        self.requests_handled += 1
+        request_id = request.get("id")
+        method = request.get("method")
+        params = request.get("params", {})
+        resource = params.get("resource", "")
+        args = params.get("args", [])
+        resource_type = resource.split("[", 1)[0]
+
+        if method == "unsubscribe":
+            client.subscriptions.discard(resource)
+            return [self._encode({"jsonrpc": "2.0", "id": request_id, "result": True})]
+        if method in self.events.get(resource_type, ()):
+            resource_id = f"{resource_type}.{method}"
+            client.subscriptions.add(resource_id)
+            return [self._encode({"jsonrpc": "2.0", "id": request_id, "result": {
+                "_type": "SUBSCRIPTION", "resourceId": resource_id, "emitter": "STREAM"}})]
+
+        handler = self.handlers.get(f"{resource_type}.{method}")
+        if handler == None:
+            return [self._encode({"jsonrpc": "2.0", "id": request_id, "error": {
+                "code": -32601, "message": f"method {method} not found on {resource}"}})]
+        try:
+            result = handler(resource, args)
+        except (KeyError, IndexError, TypeError) as e:
+            return [self._encode({"jsonrpc": "2.0", "id": request_id, "error": {
+                "code": -32602, "message": f"invalid call to {method} on {resource}: {e!r}"}})]
+
+        if isinstance(result, _MockPromise):
+            promise_id = uuid.uuid4().hex
+            return [
+                self._encode({"jsonrpc": "2.0", "id": request_id, "result": {
+                    "_type": "SUBSCRIPTION", "resourceId": promise_id, "emitter": "PROMISE"}}),
+                self._encode({"jsonrpc": "2.0", "id": None, "result": {
+                    "_type": "EVENT", "emitter": "PROMISE", "resourceId": promise_id,
+                    "isRejected": result.rejected, "data": result.data}}),
+            ]
+        return [self._encode({"jsonrpc": "2.0", "id": request_id, "result": result})]
+
+    def _encode(self, message: dict) -> bytes:
+        return bytes(json.dumps(message) + "\n", "utf-8")
+
+    @staticmethod
+    def _find(items: list, field: str, value):
+        return next((item for item in items if item[field] == value), None)
+
+    def _source(self, resource: str) -> dict:
+        source_id = resource.split('"')[1]
+        source = self._find(self.sources, "sourceId", source_id)
+        if source == None:
+            raise KeyError(source_id)
+        return source
+
+    @staticmethod
+    def _source_model(source: dict) -> dict:
+        return {k: v for k, v in source.items() if not k.startswith("_")}
+
+    @staticmethod
+    def _audio_model(source: dict) -> dict:
+        return {
+            "sourceId": source["sourceId"], "name": source["name"], "resourceId": f'AudioSource["{source["sourceId"]}"]',
+            "fader": {"db": 0.0, "deflection": source["_deflection"], "mul": source["_deflection"]},
+            "audioMixers": 1, "monitoringType": 0, "forceMono": False, "syncOffset": 0,
+            "muted": source["muted"], "mixerHidden": False,
+        }
+
+    def _performance_model(self) -> dict:
+        model = dict(self.performance)
+        model["CPU"] = max(0.0, model["CPU"] + random.uniform(-1, 1))
+        return model
+
+    def _make_scene_active(self, resource: str, args: list) -> bool:
+        scene = self._find(self.scenes, "id", args[0])
+        if scene == None:
+            return False
+        self.active_scene_id = scene["id"]
+        self.emit("ScenesService.sceneSwitched", scene)
+        return True
+
+    def _remove_scene(self, resource: str, args: list) -> None:
+        scene = self._find(self.scenes, "id", args[0])
+        if scene != None:
+            self.scenes.remove(scene)
+            self.emit("ScenesService.sceneRemoved", scene)
+
+    def _remove_source(self, resource: str, args: list) -> None:
+        source = self._find(self.sources, "sourceId", args[0])
+        if source != None:
+            self.sources.remove(source)
+            self.emit("SourcesService.sourceRemoved", self._source_model(source))
+
+    def _update_settings(self, resource: str, args: list) -> None:
+        source = self._source(resource)
+        source["_settings"].update(args[0])
+        self.emit("SourcesService.sourceUpdated", self._source_model(source))
+
+    def _set_name(self, resource: str, args: list) -> None:
+        source = self._source(resource)
+        source["name"] = args[0]
+        self.emit("SourcesService.sourceUpdated", self._source_model(source))
+
+    def _set_muted(self, resource: str, args: list) -> None:
+        source = self._source(resource)
+        source["muted"] = bool(args[0])
+        self.emit("SourcesService.sourceUpdated", self._source_model(source))
+
+    def _set_deflection(self, resource: str, args: list) -> None:
+        self._source(resource)["_deflection"] = float(args[0])
+
+    def _rename_collection(self, resource: str, args: list) -> _MockPromise:
+        collection = self._find(self.collections, "id", args[0])
+        if collection == None or len(args) < 2:
+            return _MockPromise(None, True)
+        collection["name"] = args[1]
+        return _MockPromise(None)
+
+    def _delete_collection(self, resource: str, args: list) -> _MockPromise:
+        collection = self._find(self.collections, "id", args[0] if args else None)
+        if collection == None:
+            return _MockPromise(None, True)
+        self.collections.remove(collection)
+        return _MockPromise(None)
+
+
+class _MockClient:
+
+    def __init__(self, writer: asyncio.StreamWriter, task: asyncio.Task):
+        self.writer = writer
+        self.task = task
+        self.subscriptions = set()
+        # set while a broadcast left a message half written, see MockSlobsServer.broadcast
+        self.partial = False
+        self.held = []
+
+    def write(self, message: bytes) -> None:
+        if self.partial:
+            self.held.append(message)
+        else:
+            self.writer.write(message)
+
+
+class TrafficReplay:
+    """Plays the SLOBS side of a capture (see TrafficRecorder) back through a MockSlobsServer.
+
+    Everything SLOBS sent is written to the server's clients in the chunks it was originally
+    read in, at the original pace or `speed` times faster (0 for as fast as possible), which
+    makes it easy to load test the receive path with a real mix of responses and events:
+
+        replay = pyslobs.TrafficReplay("session.capture")
+        async with pyslobs.MockSlobsServer(path="/tmp/replay.sock") as server:
+            replay.install(server)
+            slobs = pyslobs.Slobs(server.transport())
+            await slobs.start()
+            subscriptions = await replay.subscribe(slobs.connection)
+            print(await replay.play(server, speed=50))
+
+    Responses to requests from the original session get their id replaced with null when
+    the capture is loaded, since the ids would otherwise clash with the ones the client is
+    using now. They still get parsed, and are then ignored just like late responses.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._event_ids = set()
+        self.records = self._strip_ids([(t, data) for direction, t, data in read_capture(path) if direction == "<"])
+
+    def _strip_ids(self, records: list) -> list:
+        # null the ids of responses, keeping the chunks split at the same points of the same messages
+        stream = b"".join(data for _, data in records)
+        out = bytearray()
+        # (old start, old end, new start, new length) of every line
+        lines = []
+        start = 0
+        while start < len(stream):
+            end = stream.find(b"\n", start)
+            end = len(stream) if end == -1 else end + 1
+            line = stream[start:end]
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if isinstance(message, dict):
+                result = message.get("result")
+                if isinstance(result, dict) and result.get("_type") == "EVENT" and result.get("emitter") == "STREAM":
+                    self._event_ids.add(result["resourceId"])
+                if message.get("id") != None:
+                    message["id"] = None
+                    line = bytes(json.dumps(message) + ("\n" if line.endswith(b"\n") else ""), "utf-8")
+            lines.append((start, end, len(out), len(line)))
+            out += line
+            start = end
+        chunks = []
+        offset = 0
+        new_offset = 0
+        i = 0
+        for t, data in records:
+            offset += len(data)
+            while i < len(lines) and lines[i][1] < offset:
+                i += 1
+            if i < len(lines):
+                old_start, _, new_start, new_length = lines[i]
+                end = new_start + min(offset - old_start, new_length)
+            else:
+                end = len(out)
+            if end > new_offset:
+                chunks.append((t, bytes(out[new_offset:end])))
+                new_offset = end
+        return chunks
+
+    def event_ids(self) -> set:
+        # resource ids of every STREAM event in the capture, e.g. "SourcesService.sourceUpdated"
+        return self._event_ids
+
+    def install(self, server: "MockSlobsServer") -> None:
+        # let clients of the server subscribe to everything the capture has events for
+        for resource_id in self.event_ids():
+            resource, event = resource_id.rsplit(".", 1)
+            server.events.setdefault(resource, set()).add(event)
+
+    async def subscribe(self, connection: SlobsConnection, maxsize: int=256, overflow: str=DROP_OLDEST) -> list:
+        subscriptions = []
+        for resource_id in sorted(self.event_ids()):
+            resource, event = resource_id.rsplit(".", 1)
+            subscriptions.append(await connection.subscribe(resource, event, maxsize, overflow))
+        return subscriptions
+
+    async def play(self, server: "MockSlobsServer", speed: float=1.0) -> dict:
+        if not self.records:
+            return {"chunks": 0, "bytes": 0, "elapsed": 0.0, "recorded": 0.0, "speedup": None}
+        first = self.records[0][0]
+        nbytes = 0
+        start = time.monotonic()
+        for t, data in self.records:
+            if speed:
+                delay = (t - first) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            server.broadcast(data)
+            nbytes += len(data)
+            await server.drain()
+        if not self.records[-1][1].endswith(b"\n"):
+            # the capture stopped partway through a message, finish the line so the clients carry on
+            server.broadcast(b"\n")
+        elapsed = time.monotonic() - start
+        recorded = self.records[-1][0] - first
+        return {"chunks": len(self.records), "bytes": nbytes, "elapsed": elapsed, "recorded": recorded,
+                "speedup": recorded / elapsed if elapsed > 0 else None}